@@ -0,0 +1,80 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited before accepting connections.")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Server on port {port} did not start.")
+
+
+@contextmanager
+def serve(app: str, env: Optional[Dict[str, str]] = None):
+    # runs a uvicorn app in a subprocess and yields (base url, process)
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port)],
+        cwd=ROOT,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port, process)
+        yield f"http://127.0.0.1:{port}", process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def peak_rss(pid: int) -> Optional[int]:
+    # high water mark of a process in bytes, Linux only
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(
+    timings: List[float], peak: Optional[int] = None, elapsed: Optional[float] = None
+) -> Dict:
+    # elapsed overrides the sum of timings for concurrent scenarios
+    elapsed = elapsed if elapsed is not None else sum(timings)
+    return {
+        "count": len(timings),
+        "ops": len(timings) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(timings, 50) * 1000 if timings else None,
+        "p95_ms": percentile(timings, 95) * 1000 if timings else None,
+        "p99_ms": percentile(timings, 99) * 1000 if timings else None,
+        "peak_kib": peak // 1024 if peak is not None else None,
+    }
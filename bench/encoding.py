@@ -0,0 +1,73 @@
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from bench.common import summarize
+
+
+def encoders(response_model) -> Dict[str, Callable]:
+    # each encoder turns a served record into the bytes of a response body
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from src.encoding import encode_json
+
+    return {
+        # a plain dict returned without a response model
+        "jsonable": lambda record: JSONResponse(jsonable_encoder(record.json())).body,
+        # FastAPI serializes through pydantic when a response model is set
+        "model": lambda record: response_model.model_validate(record.json())
+        .model_dump_json()
+        .encode(),
+        "orjson": lambda record: encode_json(record.json()),
+        "pre-encoded": lambda record: record.encoded(),
+    }
+
+
+def time_encoder(encode: Callable, records: List, rounds: int) -> Dict:
+    timings = []
+    for _ in range(rounds):
+        for record in records:
+            started = time.perf_counter()
+            encode(record)
+            timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-response cost of encoding problem payloads."
+    )
+    parser.add_argument("--topics", type=int, nargs="+")
+    parser.add_argument("--problems", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from main import ProblemResponse
+    from src.differential import is_generatable, problem_classes
+    from src.executor import render_cas
+    from src.utils import SpRand
+
+    SpRand.seed(args.seed)
+    topics = args.topics or [id for id in problem_classes if is_generatable(id)]
+    records = []
+    for topic_id in topics:
+        for record in render_cas(topic_id, args.problems):
+            # stands in for the LLM text, which dominates the payload size
+            records.append(record.with_content("Find the derivative. " * 20))
+    records = [record.with_body() for record in records]
+    size = sum(len(record.body) for record in records) / len(records)
+
+    print(f"{len(records)} payloads, {size:.0f} bytes on average")
+    print(f"{'encoder':<14}{'ops/s':>12}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}")
+    for name, encode in encoders(ProblemResponse).items():
+        result = time_encoder(encode, records, args.rounds)
+        print(
+            f"{name:<14}{result['ops']:>12.0f}{result['p50_ms'] * 1000:>10.1f}"
+            f"{result['p95_ms'] * 1000:>10.1f}{result['p99_ms'] * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
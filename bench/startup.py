@@ -0,0 +1,84 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.common import ROOT, free_port
+
+IMPORT_SCRIPT = (
+    "import time; started = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_import(module: str, runs: int):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT.format(module=module)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def measure_first_request(runs: int, path: str):
+    # process start until the first successful response
+    timings = []
+    for _ in range(runs):
+        port = free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                try:
+                    response = httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1)
+                    if response.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if server.poll() is not None:
+                    raise RuntimeError("Server exited before answering.")
+                time.sleep(0.01)
+            timings.append(time.perf_counter() - started)
+        finally:
+            server.terminate()
+            server.wait()
+    return timings
+
+
+def report(name: str, timings):
+    print(
+        f"{name}: median {statistics.median(timings) * 1000:.0f} ms, "
+        f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms "
+        f"({len(timings)} runs)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API process startup.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", nargs="+", default=["main"])
+    parser.add_argument("--path", default="/topic")
+    parser.add_argument("--no-server", action="store_true")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        report(f"import {module}", measure_import(module, args.runs))
+    if not args.no_server:
+        report(f"first GET {args.path}", measure_first_request(args.runs, args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List
+
+import httpx
+
+from bench.common import peak_rss, serve, summarize
+
+CAS_STAGES = ["inputs", "construct", "json", "check"]
+STAGES = CAS_STAGES + ["wrap", "http"]
+
+
+def run_stage(op: Callable, items: Iterable, trace: bool = False):
+    results, timings = [], []
+    if trace:
+        tracemalloc.start()
+    for item in items:
+        started = time.perf_counter()
+        results.append(op(item))
+        timings.append(time.perf_counter() - started)
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results, (timings, peak)
+
+
+def cas_pipeline(problem_class, count: int, budget: float, trace: bool) -> Dict:
+    # every stage works on fresh objects so the render cache never short-cuts json
+    stages = {}
+    inputs, stages["inputs"] = run_stage(
+        lambda _: problem_class.generate_random_inputs(), range(count), trace
+    )
+    problems, stages["construct"] = run_stage(
+        lambda kwargs: problem_class(**kwargs), inputs, trace
+    )
+    payloads, stages["json"] = run_stage(lambda p: p.json(), problems, trace)
+    _, stages["check"] = run_stage(
+        lambda pair: pair[0].check(pair[1]["answer"]["symbolic"], budget),
+        zip(problems, payloads),
+        trace,
+    )
+    return stages, problems
+
+
+async def wrap_stage(problems: List) -> Dict:
+    # the first call imports the SDK and opens the connection, keep it out
+    await problems[0].wrap_with_llm()
+    # network bound, so tracing for the memory peak barely moves the timings
+    timings = []
+    tracemalloc.start()
+    for problem in problems:
+        started = time.perf_counter()
+        await problem.wrap_with_llm()
+        timings.append(time.perf_counter() - started)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(timings, peak)
+
+
+async def wrap_stages(problems: Dict[str, List]) -> Dict:
+    # one event loop for all topics, the LLM client's connection pool is bound to it
+    return {key: await wrap_stage(items) for key, items in problems.items()}
+
+
+async def http_load(
+    url: str, paths: List[str], duration: float, concurrency: int
+) -> Dict:
+    timings, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def worker(offset: int, client: httpx.AsyncClient):
+        nonlocal errors
+        index = offset
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get(paths[index % len(paths)])
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            index += concurrency
+            if ok:
+                timings.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i, client) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return {**summarize(timings, elapsed=elapsed), "errors": errors}
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base or not base.get("ops") or not result.get("ops"):
+            continue
+        change = result["ops"] / base["ops"] - 1
+        result["change"] = change
+        if change < -threshold:
+            regressions.append(key)
+    return regressions
+
+
+def report(results: Dict, regressions: List[str]):
+    def cell(value, digits=2):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    print(
+        f"{'benchmark':<16}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'peak KiB':>10}{'vs base':>9}"
+    )
+    for key, result in results.items():
+        change = result.get("change")
+        change = "-" if change is None else f"{change * 100:+.1f}%"
+        flag = "  REGRESSION" if key in regressions else ""
+        print(
+            f"{key:<16}{cell(result['ops'], 1):>10}{cell(result['p50_ms']):>10}"
+            f"{cell(result['p95_ms']):>10}{cell(result['p99_ms']):>10}"
+            f"{cell(result['peak_kib'], 0):>10}{change:>9}{flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark problem generation, rendering, checking and wrapping."
+    )
+    parser.add_argument("--topics", type=int, nargs="+")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--memory-iterations", type=int, default=10)
+    parser.add_argument("--llm-iterations", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--check-budget", type=float, default=2)
+    parser.add_argument("--http-duration", type=float, default=10)
+    parser.add_argument("--http-concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--baseline", help="compare against a saved JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results, wrap_problems = {}, {}
+    stub_env = {"STUB_LLM_LATENCY": str(args.llm_latency)}
+    with serve("src.stub_llm:app", stub_env) as (stub_url, _):
+        # the app under test reads its settings on import, contexts must not be cached
+        os.environ["LLM_PROVIDERS"] = f"ollama:stub@{stub_url}/v1"
+        os.environ["LLM_CACHE_PATH"] = ""
+        from src.differential import is_generatable, problem_classes
+        from src.utils import SpRand
+
+        SpRand.seed(args.seed)
+        topics = args.topics or [id for id in problem_classes if is_generatable(id)]
+        for topic_id in topics:
+            problem_class = problem_classes[topic_id]
+            if problem_class.use_table:
+                # the server fills render tables during warm-up, time the steady state
+                problem_class.precompute()
+            stages, problems = cas_pipeline(
+                problem_class, args.iterations, args.check_budget, False
+            )
+            traced, _ = cas_pipeline(
+                problem_class, args.memory_iterations, args.check_budget, True
+            )
+            for stage in CAS_STAGES:
+                if stage in args.stages:
+                    timings, _ = stages[stage]
+                    results[f"{topic_id}:{stage}"] = summarize(
+                        timings, traced[stage][1]
+                    )
+            if "wrap" in args.stages:
+                # filled in below, the placeholder keeps the report order
+                results[f"{topic_id}:wrap"] = None
+                wrap_problems[f"{topic_id}:wrap"] = problems[: args.llm_iterations]
+            print(f"Topic {topic_id} done.", file=sys.stderr)
+        results.update(asyncio.run(wrap_stages(wrap_problems)))
+
+        if "http" in args.stages:
+            with serve("main:app") as (url, server):
+                paths = [f"/problem/{id}" for id in topics]
+                results["http:problem"] = asyncio.run(
+                    http_load(url, paths, args.http_duration, args.http_concurrency)
+                )
+                peak = peak_rss(server.pid)
+                if peak is not None:
+                    results["http:problem"]["peak_kib"] = peak // 1024
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    report(results, regressions)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,21 +23,33 @@ function App() {
     fetchTopics();
   }, []);
 
-  // Generate problem for selected topic
-  const generateProblem = async () => {
+  // Generate problem for selected topic, streaming the content as it arrives
+  const generateProblem = () => {
     if (selectedTopic === null) return;
     setLoading(true);
-    try {
-      const response = await axios.get(
-        `${API_BASE_URL}/problem/${selectedTopic}`
-      );
-      console.log(response.data);
-      setProblem(response.data);
-    } catch (error) {
-      console.error("Error generating problem:", error);
-    } finally {
+    const source = new EventSource(
+      `${API_BASE_URL}/problem/${selectedTopic}/stream`
+    );
+    const finish = () => {
+      source.close();
       setLoading(false);
-    }
+    };
+    source.addEventListener("problem", (e) => {
+      setProblem(JSON.parse(e.data));
+    });
+    source.addEventListener("delta", (e) => {
+      const { text } = JSON.parse(e.data);
+      setProblem((prev) => ({ ...prev, content: prev.content + text }));
+    });
+    source.addEventListener("done", (e) => {
+      const { content } = JSON.parse(e.data);
+      setProblem((prev) => ({ ...prev, content }));
+      finish();
+    });
+    source.addEventListener("error", (e) => {
+      console.error("Error generating problem:", e);
+      finish();
+    });
   };
 
   return (
@@ -1,12 +1,72 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Any
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import argparse
 import asyncio
+import hashlib
+import importlib
+import json
+import os
+import time
+
+import sympy as sp
 
 import src.differential as diff
-from src.differential import problem_classes
+from src import metrics
+from src.check import check_token_answers
+from src.dedup import DedupIndex
+from src.differential import is_generatable, problem_classes
+from src.encoding import encode_json
+from src.executor import executor
+from src.pool import ProblemPool
+from src.problem import (
+    clean_content,
+    generate_content,
+    stream_content,
+    wrap_many_with_llm,
+)
+from src.record import ProblemRecord
+from src.signing import SECRET_ID, unsign
+
+MAX_BATCH_SIZE = 200
+MAX_CHECK_SIZE = 500
+CHECK_BUDGET = float(os.getenv("CHECK_BUDGET", "2"))
+CHECK_TOTAL_BUDGET = float(os.getenv("CHECK_TOTAL_BUDGET", "10"))
+TOPIC_CACHE_CONTROL = os.getenv("TOPIC_CACHE_CONTROL", "public, max-age=3600")
+SEEDED_CACHE_CONTROL = os.getenv("SEEDED_CACHE_CONTROL", "public, max-age=86400")
+# the code that maps a seed to its payload
+GENERATOR_MODULES = (
+    "src.problem",
+    "src.differential",
+    "src.utils",
+    "src.dedup",
+    "src.numeric",
+    "src.record",
+    "src.signing",
+)
+
+pool = ProblemPool()
+dedup = DedupIndex()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics.start()
+    executor.start()
+    pool.start()
+    warm_up = asyncio.create_task(executor.warm_up())
+    yield
+    warm_up.cancel()
+    await pool.stop()
+    executor.shutdown()
+    metrics.stop()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,23 +77,318 @@ app.add_middleware(
 )
 
 
-@app.get("/topic", response_model=Any)
-def get_topics():
-    topics = [{"id": id, "name": problem_classes[id].name} for id in problem_classes]
-    return topics
+if metrics.ENABLED:
+
+    @app.middleware("http")
+    async def record_timing(request: Request, call_next):
+        started = time.perf_counter()
+        trace = [] if metrics.LOG_TIMINGS else None
+        with metrics.tracing(trace):
+            response = await call_next(request)
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.observe(
+            "http_request_seconds",
+            elapsed,
+            method=request.method,
+            path=path,
+            status=response.status_code,
+        )
+        if trace is not None:
+            log = {
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "seconds": round(elapsed, 6),
+                "stages": trace,
+            }
+            print(json.dumps(log))
+        return response
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # weak comparison, as If-None-Match requires
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def json_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    # pre-encoded bodies skip FastAPI's validation and serialization
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class Topic(BaseModel):
+    id: int
+    name: str
+    options: List[Tuple[int, int]]
+
 
+class Answer(BaseModel):
+    symbolic: str
+    numeric: Optional[str] = None
 
-@app.get("/problem/{topic_id}")
-async def generate_problem(topic_id: int):
-    if topic_id not in problem_classes:
+
+class ProblemResponse(BaseModel):
+    topic_id: int
+    name: str
+    description: str
+    level: int
+    difficulty: int
+    tags: List[str]
+    expression: str
+    solution: List[str]
+    answer: Answer
+    content: str
+    key: str
+    token: str
+    seed: Optional[int] = None
+
+
+@lru_cache(maxsize=None)
+def topics_body() -> Tuple[bytes, str]:
+    topics = [
+        {
+            "id": id,
+            "name": problem_classes[id].name,
+            "options": (
+                sorted(problem_classes[id].region_index()) if is_generatable(id) else []
+            ),
+        }
+        for id in problem_classes
+    ]
+    body = encode_json(topics)
+    return body, f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+@app.get("/topic", response_model=List[Topic])
+def get_topics(request: Request):
+    body, etag = topics_body()
+    headers = {"ETag": etag, "Cache-Control": TOPIC_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return json_response(body, headers)
+
+
+def seen_keys(topic_id: int, session: Optional[str]):
+    if not session:
+        return set()
+    return dedup.keys(DedupIndex.scope(session, topic_id))
+
+
+def mark_seen(topic_id: int, key: str, session: Optional[str]):
+    if session:
+        dedup.add(DedupIndex.scope(session, topic_id), key)
+
+
+async def next_problem(
+    topic_id: int,
+    session: Optional[str],
+    level: Optional[int],
+    difficulty: Optional[int],
+    seed: Optional[int] = None,
+    wrap: bool = True,
+) -> ProblemRecord:
+    if topic_id not in problem_classes or not is_generatable(topic_id):
         raise HTTPException(status_code=404, detail="Invalid topic ID")
 
-    problem_class = problem_classes[topic_id]
+    exclude = seen_keys(topic_id, session)
+    # a seed addresses one exact problem, the pool and the filters do not apply
+    record = pool.get(topic_id, exclude, level, difficulty) if seed is None else None
+    if record is None:
+        try:
+            if seed is not None:
+                record = await executor.regenerate(topic_id, seed)
+            else:
+                record = (
+                    await executor.generate(
+                        topic_id,
+                        level=level,
+                        min_difficulty=difficulty,
+                        max_difficulty=difficulty,
+                        exclude=exclude,
+                    )
+                )[0]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail="Problem generation timed out")
+        if wrap:
+            record = record.with_content(await generate_content(record.json()))
+    mark_seen(record.topic_id, record.key, session)
+    return record
+
+
+@lru_cache(maxsize=None)
+def generator_version() -> str:
+    # a deploy that changes the generator or SymPy maps seeds to other problems
+    digest = hashlib.sha1(sp.__version__.encode())
+    for name in GENERATOR_MODULES:
+        with open(importlib.import_module(name).__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:8]
 
-    inputs = problem_class.generate_random_inputs()
-    problem = problem_class(**inputs)
-    await problem.wrap_with_llm()
-    return problem.json()
+
+def seed_etag(topic_id: int, seed: int) -> str:
+    # built from the request alone, so revalidating skips the CAS work; weak
+    # because the LLM content may differ, and keyed to the token secret and
+    # the generator version
+    return f'W/"{topic_id}-{seed}-{SECRET_ID}-{generator_version()}"'
+
+
+@app.get("/problem/{topic_id}", response_model=ProblemResponse)
+async def generate_problem(
+    request: Request,
+    topic_id: int,
+    session: Optional[str] = None,
+    level: Optional[int] = None,
+    difficulty: Optional[int] = None,
+    seed: Optional[int] = None,
+):
+    if seed is None:
+        record = await next_problem(topic_id, session, level, difficulty)
+        return json_response(record.encoded(), {"Cache-Control": "no-store"})
+    if topic_id not in problem_classes or not is_generatable(topic_id):
+        raise HTTPException(status_code=404, detail="Invalid topic ID")
+    etag = seed_etag(topic_id, seed)
+    headers = {"ETag": etag, "Cache-Control": SEEDED_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    record = await next_problem(topic_id, session, level, difficulty, seed)
+    return json_response(record.encoded(), headers)
+
+
+def sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/problem/{topic_id}/stream")
+async def stream_problem(
+    topic_id: int,
+    session: Optional[str] = None,
+    level: Optional[int] = None,
+    difficulty: Optional[int] = None,
+    seed: Optional[int] = None,
+):
+    record = await next_problem(topic_id, session, level, difficulty, seed, wrap=False)
+    problem = record.json()
+
+    async def events():
+        yield sse("problem", problem)
+        if problem["content"]:
+            yield sse("done", {"content": problem["content"]})
+            return
+        chunks = []
+        try:
+            async for chunk in stream_content(problem):
+                chunks.append(chunk)
+                yield sse("delta", {"text": chunk})
+        except Exception as e:
+            print(f"Stream: Error: {e}")
+            yield sse("error", {"detail": "Failed to generate content"})
+            return
+        yield sse("done", {"content": clean_content("".join(chunks))})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class BatchItem(BaseModel):
+    topic_id: int
+    count: int = Field(1, ge=1, le=MAX_BATCH_SIZE)
+    level: Optional[int] = None
+    min_difficulty: Optional[int] = None
+    max_difficulty: Optional[int] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    pack_size: int = Field(1, ge=1, le=10)
+    concurrency: int = Field(4, ge=1, le=16)
+    session: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    problems: List[ProblemResponse]
+
+
+@app.post("/problems/batch", response_model=BatchResponse)
+async def generate_problems(request: BatchRequest):
+    if sum(item.count for item in request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_SIZE} problems per batch"
+        )
+    problems = []
+    for item in request.items:
+        if item.topic_id not in problem_classes or not is_generatable(item.topic_id):
+            raise HTTPException(status_code=404, detail="Invalid topic ID")
+        # problems are unique within the batch and against the session
+        exclude = seen_keys(item.topic_id, request.session)
+        exclude.update(p["key"] for p in problems if p["topic_id"] == item.topic_id)
+        try:
+            records = await executor.generate(
+                item.topic_id,
+                item.count,
+                item.level,
+                item.min_difficulty,
+                item.max_difficulty,
+                exclude,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail="Problem generation timed out")
+        problems += [record.json() for record in records]
+
+    await wrap_many_with_llm(problems, request.pack_size, request.concurrency)
+    for problem in problems:
+        mark_seen(problem["topic_id"], problem["key"], request.session)
+    return json_response(encode_json({"problems": problems}))
+
+
+class CheckRequest(BaseModel):
+    token: str
+    answers: List[str] = Field(..., min_length=1, max_length=MAX_CHECK_SIZE)
+
+
+class CheckResponse(BaseModel):
+    results: List[bool]
+
+
+@app.post("/check", response_model=CheckResponse)
+async def check_answers(request: CheckRequest):
+    try:
+        data = unsign(request.token)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid problem token")
+
+    # the worker stops itself after CHECK_TOTAL_BUDGET, a task it is still
+    # running could not be cancelled from here
+    try:
+        results = await executor.run(
+            check_token_answers,
+            data["answer"],
+            request.answers,
+            CHECK_BUDGET,
+            CHECK_TOTAL_BUDGET,
+            timeout=executor.timeout + CHECK_TOTAL_BUDGET,
+        )
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Answer checking timed out")
+    return {"results": results}
+
+
+@app.get("/metrics")
+def get_metrics():
+    for topic_id in pool.topics:
+        metrics.set_gauge("pool_problems", pool.size(topic_id), topic=topic_id)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 async def main():
@@ -48,5 +403,43 @@ async def main():
     print(problem)
 
 
+def serve(host: str, port: int, workers: int, graceful_timeout: float):
+    import uvicorn
+
+    if workers > 1:
+        # workers share pooled problems and sessions through SQLite unless set
+        os.environ.setdefault("POOL_STORE", "sqlite:///pool.sqlite3")
+        os.environ.setdefault("DEDUP_PATH", "dedup.sqlite3")
+        # each worker publishes its counts there, /metrics reports their sum
+        metrics.reset(os.environ.setdefault("METRICS_PATH", "metrics.sqlite3"))
+        cpus = os.cpu_count() or 1
+        os.environ.setdefault("CAS_WORKERS", str(max(1, cpus // workers)))
+    # PROBLEM_TOKEN_SECRET was exported when src.signing was imported, every
+    # worker inherits it and accepts the tokens of the others
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        timeout_graceful_shutdown=graceful_timeout,
+    )
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Run the demo or serve the API.")
+    parser.add_argument("command", nargs="?", choices=["demo", "serve"], default="demo")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("API_WORKERS", "1"))
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=float(os.getenv("API_GRACEFUL_TIMEOUT", "30")),
+    )
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.graceful_timeout)
+    else:
+        asyncio.run(main())
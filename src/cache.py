@@ -0,0 +1,118 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class ContentCache:
+    def __init__(
+        self,
+        path: str = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3"),
+        ttl: float = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+        max_keys: int = int(os.getenv("LLM_CACHE_MAX_KEYS", "10000")),
+        max_variants: int = int(os.getenv("LLM_CACHE_MAX_VARIANTS", "5")),
+        reuse_ratio: float = float(os.getenv("LLM_CACHE_REUSE_RATIO", "0.8")),
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.max_variants = max_variants
+        self.reuse_ratio = reuse_ratio
+        self.connection: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.max_variants > 0
+
+    @staticmethod
+    def key(data: Dict) -> str:
+        # sp.latex renders the canonical (auto-ordered) SymPy tree of the expression
+        return f"{data['topic_id']}:{data['expression']}"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            # API workers share the file, WAL lets them read while one writes
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS keys (
+                    key TEXT PRIMARY KEY,
+                    last_used REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS contents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS contents_key ON contents (key);
+                CREATE INDEX IF NOT EXISTS keys_last_used ON keys (last_used);
+                """)
+        return self.connection
+
+    def variants(self, key: str) -> List[str]:
+        if not self.enabled:
+            return []
+        with self.lock:
+            db = self._connect()
+            rows = db.execute(
+                "SELECT content FROM contents WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchall()
+            if rows:
+                with db:
+                    db.execute(
+                        "UPDATE keys SET last_used = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+        return [row[0] for row in rows]
+
+    def lookup(self, key: str) -> Optional[str]:
+        # serve a stored variant, or None when a fresh completion should be made
+        variants = self.variants(key)
+        if not variants:
+            return None
+        if len(variants) >= self.max_variants or random.random() < self.reuse_ratio:
+            return random.choice(variants)
+        return None
+
+    def add(self, key: str, content: str):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self.lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT INTO contents (key, content, created_at) VALUES (?, ?, ?)",
+                    (key, content, now),
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO keys (key, last_used) VALUES (?, ?)",
+                    (key, now),
+                )
+                db.execute(
+                    "DELETE FROM contents WHERE key = ? AND id NOT IN ("
+                    "SELECT id FROM contents WHERE key = ? "
+                    "ORDER BY created_at DESC LIMIT ?)",
+                    (key, key, self.max_variants),
+                )
+                self._evict(db, now)
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        db.execute("DELETE FROM contents WHERE created_at < ?", (now - self.ttl,))
+        db.execute(
+            "DELETE FROM keys WHERE key IN ("
+            "SELECT key FROM keys ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,),
+        )
+        db.execute("DELETE FROM contents WHERE key NOT IN (SELECT key FROM keys)")
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,169 @@
+import random
+import re
+from typing import List, Optional, Union
+
+import numpy as np
+import sympy as sp
+
+from src.numeric import evaluate
+from src.utils import deadline_passed, time_limit
+
+SAMPLES = 16
+RTOL = 1e-6
+ATOL = 1e-9
+
+
+# SymPy's LaTeX for functions latex2sympy2 reads as something else: \log is
+# base 10 to it, the inverse trigonometric names are unknown
+_FUNCTION = re.compile(
+    r"\\log(?![_a-zA-Z])|\\operatorname\{a(sin|cos|tan|cot|sec|csc)\}"
+)
+
+
+def _group_end(latex: str, start: int) -> Optional[int]:
+    # the index after the brace group that opens at start
+    depth = 0
+    for i in range(start, len(latex)):
+        depth += {"{": 1, "}": -1}.get(latex[i], 0)
+        if depth == 0:
+            return i + 1
+    return None
+
+
+def _parsable(latex: str) -> str:
+    # the braces around the argument go too, a power after them would
+    # otherwise be read as a power of the argument
+    parts, i = [], 0
+    while match := _FUNCTION.search(latex, i):
+        parts.append(latex[i : match.start()])
+        parts.append(f"\\arc{match.group(1)} " if match.group(1) else "\\ln ")
+        i = match.end()
+        if latex.startswith("^{", i):
+            end = _group_end(latex, i + 1)
+            if end is None:
+                break
+            parts.append(latex[i:end])
+            i = end
+        if latex.startswith("{", i):
+            end = _group_end(latex, i)
+            if end is None:
+                break
+            parts.append(_parsable(latex[i + 1 : end - 1]))
+            i = end
+    parts.append(latex[i:])
+    return "".join(parts)
+
+
+def parse(answer: Union[str, sp.Basic]) -> Optional[sp.Expr]:
+    if isinstance(answer, sp.Basic):
+        return answer
+    # latex2sympy2 pulls in the antlr runtime, only the check path needs it
+    from latex2sympy2 import latex2sympy
+
+    try:
+        parsed = latex2sympy(_parsable(answer))
+    except TimeoutError:
+        raise
+    except Exception as e:
+        print(e)
+        return None
+    # lists, equations and the like are not an answer
+    return parsed if isinstance(parsed, sp.Expr) else None
+
+
+def _normalize(expr: sp.Expr) -> sp.Expr:
+    # parsed and generated symbols may differ in assumptions, match them by name
+    return expr.xreplace({s: sp.Symbol(s.name) for s in expr.free_symbols})
+
+
+def _points(symbols: List[sp.Symbol], samples: int) -> List[np.ndarray]:
+    # complex points off the real axis keep log/asin/acsc and friends defined
+    rng = random.Random(0)
+    return [
+        np.array(
+            [
+                complex(rng.uniform(0.2, 1.8), rng.uniform(0.1, 0.9))
+                for _ in range(samples)
+            ]
+        )
+        for _ in symbols
+    ]
+
+
+def numeric_equal(
+    expected: sp.Expr, answer: sp.Expr, samples: int = SAMPLES
+) -> Optional[bool]:
+    # True/False when the sample points agree, None when inconclusive
+    symbols = sorted(expected.free_symbols | answer.free_symbols, key=str)
+    points = _points(symbols, samples)
+    try:
+        with np.errstate(all="ignore"):
+            lhs = evaluate(expected, symbols, points, samples)
+            rhs = evaluate(answer, symbols, points, samples)
+    except TimeoutError:
+        raise
+    except Exception:
+        return None
+    finite = np.isfinite(lhs) & np.isfinite(rhs)
+    if finite.sum() < samples // 2:
+        return None
+    close = np.isclose(lhs[finite], rhs[finite], rtol=RTOL, atol=ATOL)
+    if close.all():
+        return True
+    if not close.any():
+        return False
+    return None
+
+
+def symbolic_equal(expected: sp.Expr, answer: sp.Expr) -> bool:
+    return bool(sp.simplify(answer).equals(expected))
+
+
+def check_answer(
+    expected: sp.Expr,
+    answer: Union[str, sp.Basic],
+    budget: Optional[float] = None,
+) -> bool:
+    # parsing and both tiers share the budget, an answer that outlasts it is
+    # wrong; an enclosing limit that ran out is raised
+    try:
+        with time_limit(budget):
+            return _check_answer(expected, answer)
+    except TimeoutError:
+        if deadline_passed():
+            raise
+        return False
+
+
+def _check_answer(expected: sp.Expr, answer: Union[str, sp.Basic]) -> bool:
+    parsed = parse(answer)
+    if parsed is None:
+        return False
+    expected, parsed = _normalize(expected), _normalize(parsed)
+    result = numeric_equal(expected, parsed)
+    if result is None:
+        result = symbolic_equal(expected, parsed)
+    return result
+
+
+def check_answers(
+    expected: sp.Expr,
+    answers: List[str],
+    budget: Optional[float] = None,
+    total: Optional[float] = None,
+) -> List[bool]:
+    # budget caps each distinct answer, total the whole list
+    results = {}
+    with time_limit(total):
+        for answer in set(answers):
+            results[answer] = check_answer(expected, answer, budget)
+    return [results[answer] for answer in answers]
+
+
+def check_token_answers(
+    answer: str,
+    answers: List[str],
+    budget: Optional[float] = None,
+    total: Optional[float] = None,
+) -> List[bool]:
+    return check_answers(sp.sympify(answer), answers, budget, total)
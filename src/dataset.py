@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from typing import Dict, List, Set
+
+from src.differential import is_generatable, problem_classes
+from src.executor import CasExecutor, render_seeded
+from src.llm import RateLimiter
+from src.problem import get_client, wrap_many_with_llm
+
+# stop a topic once this many chunks in a row produced nothing new
+MAX_STALE_CHUNKS = 5
+
+
+def chunk_seed(seed: int, topic_id: int, chunk: int) -> int:
+    digest = hashlib.sha256(f"{seed}:{topic_id}:{chunk}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def dedup_key(record: Dict) -> str:
+    return f"{record['topic_id']}:{record['key']}"
+
+
+def shard_path(output: str, topic_id: int, chunk: int, format: str) -> str:
+    return os.path.join(output, f"topic-{topic_id:02d}", f"shard-{chunk:05d}.{format}")
+
+
+def read_shard(path: str) -> List[Dict]:
+    if path.endswith(".parquet"):
+        import pandas as pd
+
+        return pd.read_parquet(path).to_dict("records")
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_shard(path: str, records: List[Dict], format: str):
+    # write to a temporary file first so a finished shard is always complete
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if format == "parquet":
+        import pandas as pd
+
+        pd.DataFrame(records).to_parquet(tmp, index=False)
+    else:
+        with open(tmp, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    os.replace(tmp, path)
+
+
+class TopicState:
+    def __init__(self, topic_id: int, target: int):
+        self.topic_id = topic_id
+        self.target = target
+        self.count = 0
+        self.next_chunk = 0
+        self.stale = 0
+        self.inflight = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.count >= self.target or self.stale >= MAX_STALE_CHUNKS
+
+
+async def build(args):
+    executor = CasExecutor(workers=args.workers, timeout=args.timeout)
+    if args.llm and args.llm_rpm > 0:
+        for backend in get_client().backends:
+            backend.client.request_limiter = RateLimiter(args.llm_rpm)
+
+    seen: Set[str] = set()
+    states = {topic_id: TopicState(topic_id, args.count) for topic_id in args.topics}
+
+    # resume: finished shards are the checkpoint
+    for state in states.values():
+        while os.path.exists(
+            path := shard_path(
+                args.output, state.topic_id, state.next_chunk, args.format
+            )
+        ):
+            records = read_shard(path)
+            seen.update(dedup_key(record) for record in records)
+            state.count += len(records)
+            state.next_chunk += 1
+        if state.count:
+            print(f"Topic {state.topic_id}: resuming with {state.count} problems")
+
+    async def run_chunk(state: TopicState, chunk: int):
+        seed = chunk_seed(args.seed, state.topic_id, chunk)
+        records = await executor.run(
+            render_seeded,
+            state.topic_id,
+            args.chunk_size,
+            seed,
+            args.timeout,
+            timeout=args.timeout * args.chunk_size + 1,
+        )
+        return state, chunk, [record.json() for record in records]
+
+    def submit(state: TopicState):
+        chunk = state.next_chunk
+        state.next_chunk += 1
+        state.inflight += 1
+        return asyncio.ensure_future(run_chunk(state, chunk))
+
+    started = time.monotonic()
+    tasks = set()
+    window = max(1, args.workers) * 2
+    executor.start()
+    try:
+        while True:
+            for state in states.values():
+                # fill the window round-robin while topics still need problems
+                while (
+                    len(tasks) < window
+                    and not state.finished
+                    and state.count + state.inflight * args.chunk_size < state.target
+                ):
+                    tasks.add(submit(state))
+            if not tasks:
+                break
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                state, chunk, records = task.result()
+                state.inflight -= 1
+                unique = []
+                for record in records:
+                    key = dedup_key(record)
+                    if key not in seen and state.count + len(unique) < state.target:
+                        seen.add(key)
+                        unique.append(record)
+                state.stale = state.stale + 1 if not unique else 0
+                if args.llm and unique:
+                    await wrap_many_with_llm(unique, args.pack_size, args.concurrency)
+                write_shard(
+                    shard_path(args.output, state.topic_id, chunk, args.format),
+                    unique,
+                    args.format,
+                )
+                state.count += len(unique)
+    finally:
+        executor.shutdown()
+
+    elapsed = time.monotonic() - started
+    total = sum(state.count for state in states.values())
+    for state in states.values():
+        note = "" if state.count >= state.target else " (input space exhausted)"
+        print(f"Topic {state.topic_id}: {state.count}/{state.target}{note}")
+    print(f"Generated {total} problems in {elapsed:.1f}s")
+
+
+def has_parquet_engine() -> bool:
+    # pandas writes parquet through pyarrow or fastparquet, neither is required
+    return importlib.util.find_spec("pandas") is not None and any(
+        importlib.util.find_spec(name) for name in ("pyarrow", "fastparquet")
+    )
+
+
+def parse_args(argv=None):
+    topics = [id for id in problem_classes if is_generatable(id)]
+    parser = argparse.ArgumentParser(
+        description="Generate a sharded, deduplicated problem dataset."
+    )
+    parser.add_argument("--topics", type=int, nargs="+", default=topics)
+    parser.add_argument("--count", type=int, default=1000, help="problems per topic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--chunk-size", type=int, default=500, help="problems per shard"
+    )
+    parser.add_argument("--output", default="dataset")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds per problem")
+    parser.add_argument("--llm", action="store_true", help="wrap problems with the LLM")
+    parser.add_argument("--llm-rpm", type=float, default=60)
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+    for topic_id in args.topics:
+        if topic_id not in topics:
+            parser.error(f"topic {topic_id} cannot be generated")
+    # checked up front, a missing engine would fail at the first shard write
+    if args.format == "parquet" and not has_parquet_engine():
+        parser.error("--format parquet needs pandas with pyarrow or fastparquet")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(build(parse_args()))
@@ -0,0 +1,92 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Set
+
+import sympy as sp
+
+# beyond this many symbols only the name-sorted renaming is tried
+MAX_PERMUTED_SYMBOLS = 5
+
+
+def canonical_key(expression: sp.Basic) -> str:
+    # invariant under renaming symbols, e.g. d/dx(a/b) and d/dy(s/r) match
+    symbols = sorted(expression.atoms(sp.Symbol), key=lambda symbol: symbol.name)
+    placeholders = [sp.Symbol(f"_{i}") for i in range(len(symbols))]
+    if len(symbols) <= MAX_PERMUTED_SYMBOLS:
+        orderings = itertools.permutations(symbols)
+    else:
+        orderings = [symbols]
+    canonical = min(
+        sp.srepr(expression.xreplace(dict(zip(ordering, placeholders))))
+        for ordering in orderings
+    )
+    return hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+
+class DedupIndex:
+    def __init__(
+        self,
+        path: str = os.getenv("DEDUP_PATH", ""),
+        ttl: float = float(os.getenv("DEDUP_TTL", str(24 * 3600))),
+        max_scopes: int = int(os.getenv("DEDUP_MAX_SCOPES", "10000")),
+    ):
+        # in memory by default, DEDUP_PATH persists the index in SQLite
+        self.path = path
+        self.ttl = ttl
+        self.max_scopes = max_scopes
+        self.scopes: OrderedDict[str, Set[str]] = OrderedDict()
+        self.connection: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def scope(session: str, topic_id: int) -> str:
+        return f"{session}:{topic_id}"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            # a session's requests may reach any API worker, all of them open the file
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                "scope TEXT NOT NULL, key TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (scope, key))"
+            )
+        return self.connection
+
+    def keys(self, scope: str) -> Set[str]:
+        with self.lock:
+            if not self.path:
+                keys = self.scopes.get(scope)
+                if keys is None:
+                    return set()
+                self.scopes.move_to_end(scope)
+                return set(keys)
+            rows = self._connect().execute(
+                "SELECT key FROM seen WHERE scope = ? AND created_at >= ?",
+                (scope, time.time() - self.ttl),
+            )
+            return {row[0] for row in rows}
+
+    def add(self, scope: str, key: str):
+        with self.lock:
+            if not self.path:
+                self.scopes.setdefault(scope, set()).add(key)
+                self.scopes.move_to_end(scope)
+                while len(self.scopes) > self.max_scopes:
+                    self.scopes.popitem(last=False)
+                return
+            db = self._connect()
+            now = time.time()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO seen (scope, key, created_at) "
+                    "VALUES (?, ?, ?)",
+                    (scope, key, now),
+                )
+                db.execute("DELETE FROM seen WHERE created_at < ?", (now - self.ttl,))
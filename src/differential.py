@@ -1,15 +1,17 @@
-import random
 import sympy as sp
+from functools import partial
 from typing import Union, List
 
-from src.problem import Problem
-from src.utils import SpRand
+from src.problem import STAGE_BUDGET, Problem
+from src.utils import FUNCTIONS, SpRand
 
 
 class DiffConstant(Problem):
     name = "Derivative of a Constant"
     description = "Calculate the derivative of a constant with respect to a variable."
     tags = ["differentiation", "basic", "constant"]
+    use_table = True
+    content_tokens = 150
 
     def __init__(
         self,
@@ -23,10 +25,29 @@ class DiffConstant(Problem):
         self.expression = sp.Derivative(const_value, self.symbols[0], evaluate=False)
         super().__init__()
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (1, difficulty, weight, partial(cls._inputs, constant, difficulty))
+            for difficulty, weight, constant in SpRand.constant_regions()
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        const_value, difficulty = SpRand.constant_with_difficulty()
-        return {"const_value": const_value, "level": 1, "difficulty": difficulty}
+    def _inputs(constant, difficulty, rng):
+        return {"const_value": constant(rng), "level": 1, "difficulty": difficulty}
+
+    @classmethod
+    def table_inputs(cls):
+        for kind, difficulty in zip(
+            SpRand.CONSTANT_KINDS, SpRand.CONSTANT_DIFFICULTIES
+        ):
+            for value in SpRand.constant_values(kind):
+                for sign in (1, -1):
+                    yield {
+                        "const_value": sign * value,
+                        "level": 1,
+                        "difficulty": difficulty + (sign < 0),
+                    }
 
     def solve_steps(self):
         constant = sp.symbols("C")
@@ -42,6 +63,7 @@ class DiffBasicFunction(Problem):
     name = "Derivative of a basic Function"
     description = "Calculate the derivative of a function with respect to a variable."
     tags = ["differentiation", "basic", "function"]
+    use_table = True
 
     def __init__(self, func_class, level: int = 1, difficulty: int = 1):
         self.level = level
@@ -53,10 +75,11 @@ class DiffBasicFunction(Problem):
         super().__init__()
 
     @staticmethod
-    def generate_random_inputs():
-        def pow(power):
-            return sp.Pow(sp.symbols("a"), power)
+    def pow(power):
+        return sp.Pow(sp.symbols("a"), power)
 
+    @classmethod
+    def input_regions(cls):
         # (function, level, difficulty)
         FUNCS = [
             (sp.exp, 1, 4),
@@ -70,11 +93,15 @@ class DiffBasicFunction(Problem):
             (sp.atan, 2, 3),
             (sp.asin, 2, 4),
             (sp.acos, 2, 4),
-            (pow, 2, 5),
+            (cls.pow, 2, 5),
+        ]
+        return [
+            (level, difficulty, 1 / 12, partial(cls._inputs, func, level, difficulty))
+            for func, level, difficulty in FUNCS
         ]
-        WEIGHTS = [1 / 12] * 12
 
-        func, level, difficulty = random.choices(FUNCS, weights=WEIGHTS, k=1)[0]
+    @staticmethod
+    def _inputs(func, level, difficulty, rng):
         return {"func_class": func, "level": level, "difficulty": difficulty}
 
     def solve_steps(self):
@@ -107,13 +134,19 @@ class DiffMulScalar(Problem):
         self.expr = expr
         super().__init__()
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (3, difficulty, weight, partial(cls._inputs, coefficient, difficulty))
+            for difficulty, weight, coefficient in SpRand.constant_regions()
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        coefficient, difficulty = SpRand.constant_with_difficulty()
-        symbols = SpRand.symbols(2)
+    def _inputs(coefficient, difficulty, rng):
+        symbols = SpRand.symbols(2, rng)
         return {
             "expr": symbols[1],
-            "coefficient": coefficient,
+            "coefficient": coefficient(rng),
             "symbols": symbols,
             "level": 3,
             "difficulty": difficulty,
@@ -155,10 +188,16 @@ class DiffAdd(Problem):
         self.expr2 = expr2
         super().__init__()
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (3, -min(sign, 0) + 4, 1 / 2, partial(cls._inputs, sign))
+            for sign in (-1, 1)
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        symbols = SpRand.symbols(3)
-        sign = random.choice([-1, 1])
+    def _inputs(sign, rng):
+        symbols = SpRand.symbols(3, rng)
         return {
             "expr1": symbols[1],
             "expr2": symbols[2],
@@ -207,9 +246,16 @@ class DiffProductVariable(DiffProduct):
     description = "Calculate the derivative of a product of two variables."
     tags = ["differentiation", "product rule", "variables"]
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (4, difficulty, 1 / 2, partial(cls._inputs, difficulty))
+            for difficulty in (1, 2)
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        symbols = SpRand.symbols(3)
+    def _inputs(difficulty, rng):
+        symbols = SpRand.symbols(3, rng)
         expr1 = symbols[1]
         expr2 = symbols[2]
         return {
@@ -217,7 +263,7 @@ class DiffProductVariable(DiffProduct):
             "expr2": expr2,
             "symbols": symbols,
             "level": 4,
-            "difficulty": random.randint(1, 2),
+            "difficulty": difficulty,
         }
 
 
@@ -252,9 +298,16 @@ class DiffQuotientVariable(DiffQuotient):
     description = "Calculate the derivative of a quotient of two variables."
     tags = ["differentiation", "quotient rule", "variables"]
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (4, difficulty, 1 / 3, partial(cls._inputs, difficulty))
+            for difficulty in (3, 4, 5)
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        symbols = SpRand.symbols(3)
+    def _inputs(difficulty, rng):
+        symbols = SpRand.symbols(3, rng)
         expr1 = symbols[1]
         expr2 = symbols[2]
         return {
@@ -262,7 +315,7 @@ class DiffQuotientVariable(DiffQuotient):
             "expr2": expr2,
             "symbols": symbols,
             "level": 4,
-            "difficulty": random.randint(3, 5),
+            "difficulty": difficulty,
         }
 
 
@@ -286,16 +339,27 @@ class DiffProductVariableMulScalar(Problem):
         self.coefficient = coefficient
         super().__init__()
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (
+                4,
+                int(difficulty / 2 + 0.5),
+                weight,
+                partial(cls._inputs, coefficient, difficulty),
+            )
+            for difficulty, weight, coefficient in SpRand.constant_regions()
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        symbols = SpRand.symbols(3)
+    def _inputs(coefficient, difficulty, rng):
+        symbols = SpRand.symbols(3, rng)
         expr1 = symbols[1]
         expr2 = symbols[2]
-        coefficient, difficulty = SpRand.constant_with_difficulty()
         return {
             "expr1": expr1,
             "expr2": expr2,
-            "coefficient": coefficient,
+            "coefficient": coefficient(rng),
             "symbols": symbols,
             "level": 4,
             "difficulty": int(difficulty / 2 + 0.5),
@@ -331,16 +395,27 @@ class DiffQuotientVariableMulScalar(Problem):
         self.coefficient = coefficient
         super().__init__()
 
+    @classmethod
+    def input_regions(cls):
+        return [
+            (
+                5,
+                min(5, difficulty + 2),
+                weight,
+                partial(cls._inputs, coefficient, difficulty),
+            )
+            for difficulty, weight, coefficient in SpRand.constant_regions()
+        ]
+
     @staticmethod
-    def generate_random_inputs():
-        symbols = SpRand.symbols(3)
+    def _inputs(coefficient, difficulty, rng):
+        symbols = SpRand.symbols(3, rng)
         expr1 = symbols[1]
         expr2 = symbols[2]
-        coefficient, difficulty = SpRand.constant_with_difficulty()
         return {
             "expr1": expr1,
             "expr2": expr2,
-            "coefficient": coefficient,
+            "coefficient": coefficient(rng),
             "symbols": symbols,
             "level": 5,
             "difficulty": min(5, difficulty + 2),
@@ -363,6 +438,11 @@ class DiffChainRule(Problem):
         "Calculate the derivative of a composite function using the chain rule."
     )
     tags = ["differentiation", "chain rule"]
+    # some compositions make doit and simplify blow up, see Problem.check_complexity
+    max_ops = 10
+    max_depth = 6
+    stage_budget = STAGE_BUDGET
+    content_tokens = 300
 
     def __init__(self, func, inner_func, symbols, level: int = 6, difficulty: int = 1):
         self.level = level
@@ -375,14 +455,26 @@ class DiffChainRule(Problem):
         )
         super().__init__()
 
+    @classmethod
+    def input_regions(cls):
+        weight = 1 / len(FUNCTIONS) ** 2
+        return [
+            (
+                6,
+                (difficulty1 + difficulty2) // 2,
+                weight,
+                partial(cls._inputs, func, inner_func, difficulty1, difficulty2),
+            )
+            for inner_func, difficulty1 in FUNCTIONS
+            for func, difficulty2 in FUNCTIONS
+        ]
+
     @staticmethod
-    def generate_random_inputs():
+    def _inputs(func, inner_func, difficulty1, difficulty2, rng):
         symbols = sp.symbols("x,")
-        inner_func, difficulty1 = SpRand.function_with_difficulty()
-        func, difficulty2 = SpRand.function_with_difficulty()
         return {
-            "func": func,
-            "inner_func": inner_func,
+            "func": SpRand.bind(func, rng),
+            "inner_func": SpRand.bind(inner_func, rng),
             "symbols": symbols,
             "level": 6,
             "difficulty": (difficulty1 + difficulty2) // 2,
@@ -419,3 +511,12 @@ problem_classes = {
     9: DiffQuotientVariableMulScalar,
     10: DiffChainRule,
 }
+
+for topic_id, problem_class in problem_classes.items():
+    problem_class.topic_id = topic_id
+
+
+def is_generatable(topic_id: int) -> bool:
+    # DiffProduct and DiffQuotient have no input regions of their own
+    problem_class = problem_classes[topic_id]
+    return problem_class.input_regions.__func__ is not Problem.input_regions.__func__
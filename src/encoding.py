@@ -0,0 +1,12 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
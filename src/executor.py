@@ -0,0 +1,276 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Set
+
+from src import metrics
+from src.differential import is_generatable, problem_classes
+from src.problem import ComplexityError, DuplicateError, Problem, exact, excluding
+from src.record import ProblemRecord
+from src.utils import SpRand, time_limit
+
+
+def generate_cas(
+    topic_id: int,
+    count: int,
+    level: Optional[int] = None,
+    min_difficulty: Optional[int] = None,
+    max_difficulty: Optional[int] = None,
+    exclude: Optional[Set[str]] = None,
+    max_attempts: int = 50,
+    max_duplicates: int = 8,
+) -> List[Problem]:
+    # every problem comes from its own seed, drawn from SpRand.rng, so it can
+    # be regenerated; exclude holds canonical keys to avoid and grows
+    problem_class = problem_classes[topic_id]
+    exclude = set() if exclude is None else exclude
+    problems = []
+    for _ in range(count):
+        problem, duplicate, duplicates = None, None, 0
+        for _ in range(max_attempts):
+            seed = problem_class.draw_seed(
+                SpRand.rng, level, min_difficulty, max_difficulty
+            )
+            try:
+                with excluding(exclude):
+                    problem = problem_class.from_seed(seed)
+                break
+            except DuplicateError:
+                # rejected before solving, a run of them means the space is used up
+                duplicate, duplicates = seed, duplicates + 1
+                if duplicates >= max_duplicates:
+                    break
+            except ComplexityError:
+                duplicates = 0
+        if problem is None and duplicate is not None:
+            # small input spaces run out, then a duplicate is repeated
+            problem = problem_class.from_seed(duplicate)
+        if problem is None:
+            raise ComplexityError(
+                f"No problem of topic {topic_id} within the complexity limits."
+            )
+        exclude.add(problem.canonical_key())
+        problems.append(problem)
+    return problems
+
+
+def render_cas(
+    topic_id: int,
+    count: int = 1,
+    level: Optional[int] = None,
+    min_difficulty: Optional[int] = None,
+    max_difficulty: Optional[int] = None,
+    timeout: Optional[float] = None,
+    exclude: Optional[Set[str]] = None,
+) -> List[ProblemRecord]:
+    exclude = set() if exclude is None else set(exclude)
+    records = []
+    for _ in range(count):
+        with time_limit(timeout):
+            problem = generate_cas(
+                topic_id, 1, level, min_difficulty, max_difficulty, exclude
+            )[0]
+            records.append(problem.record())
+    return records
+
+
+def render_from_seed(
+    topic_id: int, seed: int, timeout: Optional[float] = None
+) -> ProblemRecord:
+    # without stage budgets, a busy worker renders the same problem as an idle one
+    with time_limit(timeout), exact():
+        return problem_classes[topic_id].from_seed(seed).record()
+
+
+def render_seeded(
+    topic_id: int, count: int, seed: int, timeout: Optional[float] = None
+) -> List[ProblemRecord]:
+    # per-problem seeds are drawn from SpRand.rng, seeding it fixes the chunk
+    SpRand.seed(seed)
+    return render_cas(topic_id, count, timeout=timeout)
+
+
+def _warm_up():
+    import sympy as sp
+    from src.check import check_answer
+
+    x = sp.Symbol("x")
+    answer = sp.Derivative(sp.sin(x) * sp.exp(x), x).doit()
+    sp.latex(sp.simplify(answer))
+    check_answer(answer, r"e^{x} \sin{x} + e^{x} \cos{x}")
+
+
+def warm_up_topics() -> int:
+    # one problem per topic runs the solve, simplify and latex paths once
+    count = 0
+    for topic_id, problem_class in problem_classes.items():
+        if not is_generatable(topic_id):
+            continue
+        if problem_class.use_table:
+            problem_class.precompute()
+        # generate_cas resamples inputs the complexity guard rejects
+        generate_cas(topic_id, 1)[0].record()
+        count += 1
+    # warm-up timings would skew the stage histograms
+    metrics.drain()
+    return count
+
+
+def _call(fn, *args):
+    # runs in a worker, the metrics recorded there travel back with the result
+    trace = [] if metrics.LOG_TIMINGS else None
+    with metrics.tracing(trace):
+        result = fn(*args)
+    return result, metrics.drain(), trace
+
+
+def _ping():
+    return os.getpid()
+
+
+class CasExecutor:
+    def __init__(
+        self,
+        workers: int = int(os.getenv("CAS_WORKERS", str(os.cpu_count() or 1))),
+        timeout: float = float(os.getenv("CAS_TIMEOUT", "10")),
+        start_method: str = os.getenv("CAS_START_METHOD", "forkserver"),
+        warm_up: bool = os.getenv("CAS_WARM_UP", "1") == "1",
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.start_method = start_method
+        self.warm_up_enabled = warm_up
+        self.executor: Optional[Executor] = None
+
+    def start(self):
+        # workers=0 keeps the CAS work in the default thread pool
+        if self.executor is not None or self.workers <= 0:
+            return
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_warm_up,
+        )
+        for _ in range(self.workers):
+            self.executor.submit(_ping)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def warm_up(self):
+        # meant as a background task once the server accepts requests
+        if not self.warm_up_enabled:
+            return
+        self.start()
+        loop = asyncio.get_running_loop()
+        tasks = [
+            loop.run_in_executor(self.executor, warm_up_topics)
+            for _ in range(max(self.workers, 1))
+        ]
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"Executor: Error warming up: {result}")
+
+    async def run(self, fn, *args, timeout: Optional[float] = None):
+        self.start()
+        executor = self.executor
+        try:
+            return await self._run(executor, fn, args, timeout)
+        except BrokenProcessPool as e:
+            # a dead worker, e.g. killed for memory, breaks the pool for good
+            print(f"Executor: Error: {e}, restarting the workers")
+            if self.executor is executor:
+                self.shutdown()
+                self.start()
+            return await self._run(self.executor, fn, args, timeout)
+
+    async def _run(self, executor, fn, args, timeout: Optional[float]):
+        loop = asyncio.get_running_loop()
+        if executor is None:
+            # threads share the registry, the copied context carries the trace
+            context = contextvars.copy_context()
+            future = loop.run_in_executor(None, context.run, fn, *args)
+        else:
+            future = loop.run_in_executor(executor, _call, fn, *args)
+        try:
+            result = await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("CAS task timed out")
+        if executor is None:
+            return result
+        result, snapshot, trace = result
+        metrics.merge(snapshot, trace)
+        return result
+
+    async def regenerate(self, topic_id: int, seed: int) -> ProblemRecord:
+        return await self.run(
+            render_from_seed, topic_id, seed, self.timeout, timeout=self.timeout + 1
+        )
+
+    async def generate(
+        self,
+        topic_id: int,
+        count: int = 1,
+        level: Optional[int] = None,
+        min_difficulty: Optional[int] = None,
+        max_difficulty: Optional[int] = None,
+        exclude: Optional[Set[str]] = None,
+    ) -> List[ProblemRecord]:
+        # large counts are split across the workers, chunks do not see each
+        # other's keys, so collisions are drawn again against all of them
+        exclude = set() if exclude is None else set(exclude)
+        chunks = await asyncio.gather(
+            *(
+                self._render(
+                    topic_id, size, level, min_difficulty, max_difficulty, exclude
+                )
+                for size in self.chunk_sizes(count)
+            )
+        )
+        records, repeats = [], 0
+        for record in (record for chunk in chunks for record in chunk):
+            if record.key in exclude and len(chunks) > 1:
+                repeats += 1
+                continue
+            exclude.add(record.key)
+            records.append(record)
+        if repeats:
+            records += await self._render(
+                topic_id, repeats, level, min_difficulty, max_difficulty, exclude
+            )
+        return records
+
+    def chunk_sizes(self, count: int) -> List[int]:
+        workers = max(self.workers, 1)
+        size = max(1, -(-count // workers))
+        return [min(size, count - start) for start in range(0, count, size)]
+
+    async def _render(
+        self,
+        topic_id: int,
+        count: int,
+        level: Optional[int],
+        min_difficulty: Optional[int],
+        max_difficulty: Optional[int],
+        exclude: Set[str],
+    ) -> List[ProblemRecord]:
+        # the worker enforces the per-problem budget, the outer wait is a backstop
+        return await self.run(
+            render_cas,
+            topic_id,
+            count,
+            level,
+            min_difficulty,
+            max_difficulty,
+            self.timeout,
+            exclude,
+            timeout=self.timeout * count + 1,
+        )
+
+
+executor = CasExecutor()
@@ -1,5 +1,78 @@
+import asyncio
 import os
-from openai import AsyncClient as OpenAI
+import random
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from src import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+# the openai SDK and httpx are imported on first use, they dominate startup time
+
+# status codes worth retrying, anything else in 4xx fails immediately
+RETRYABLE_STATUS = {408, 409, 429}
+
+_http_client: Optional["httpx.AsyncClient"] = None
+
+
+def http_client() -> "httpx.AsyncClient":
+    # one keep-alive connection pool shared by every Client in the process
+    global _http_client
+    if _http_client is None:
+        import httpx
+        from openai import DefaultAsyncHttpxClient
+
+        _http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "10")),
+                keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+            ),
+        )
+    return _http_client
+
+
+def estimate_tokens(messages, completion_tokens: int = 0) -> int:
+    # ~4 characters per token is close enough for budgeting
+    characters = sum(len(str(message.get("content", ""))) for message in messages)
+    return characters // 4 + completion_tokens
+
+
+class RateLimiter:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        if not self.enabled:
+            return
+        # requests larger than the whole bucket go through once it is full
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, amount: float):
+        # settle the difference between the estimated and the actual usage
+        if self.enabled:
+            self.tokens -= amount
 
 
 class Client:
@@ -9,30 +82,147 @@ class Client:
         model: str = "gpt-4o",
         api_key: str = os.getenv("OPENAI_API_KEY", ""),
         api_url: str = os.getenv("OLLAMA_API_URL", "http://localhost:11434/v1"),
+        timeout: float = float(os.getenv("LLM_TIMEOUT", "60")),
+        max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        requests_per_minute: float = float(os.getenv("LLM_RPM", "0")),
+        tokens_per_minute: float = float(os.getenv("LLM_TPM", "0")),
+        completion_tokens: int = int(os.getenv("LLM_COMPLETION_TOKENS", "400")),
+        backoff_base: float = float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+        backoff_max: float = float(os.getenv("LLM_BACKOFF_MAX", "30")),
     ):
+        from openai import AsyncClient as OpenAI
+
         self.provider = provider
         self.model = model
         if provider == "openai":
-            self.client = OpenAI(api_key=api_key)
+            self.client = OpenAI(
+                api_key=api_key, http_client=http_client(), max_retries=0
+            )
         elif provider == "ollama":
-            self.client = OpenAI(api_key="ollama", base_url=api_url)
+            self.client = OpenAI(
+                api_key="ollama",
+                base_url=api_url,
+                http_client=http_client(),
+                max_retries=0,
+            )
         else:
             raise ValueError(
                 "Unsupported provider. Choose either 'openai' or 'ollama'."
             )
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_limiter = RateLimiter(requests_per_minute)
+        self.token_limiter = RateLimiter(tokens_per_minute)
+        self.completion_tokens = completion_tokens
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
 
-    async def chat(self, messages, max_retries: int = 3):
-        for _ in range(max_retries):
+    async def chat(self, messages, max_retries: int = 3, **options):
+        # options go to the completion call, e.g. max_tokens or response_format
+        for attempt in range(max_retries):
+            delay = None
             try:
-                content = await self._chat(messages)
+                content = await self._chat(messages, options)
                 if content:
+                    metrics.inc("llm_requests_total", backend=self.name, outcome="ok")
                     return content
             except Exception as e:
                 print(f"Chat: Error: {e}")
+                metrics.inc("llm_requests_total", backend=self.name, outcome="error")
+                if not self._retryable(e):
+                    break
+                delay = self._retry_after(e)
+            if attempt + 1 < max_retries:
+                metrics.inc("llm_retries_total", backend=self.name)
+                await asyncio.sleep(
+                    delay if delay is not None else self._backoff(attempt)
+                )
         raise Exception("Failed to generate response.")
 
-    async def _chat(self, messages):
-        completion = await self.client.chat.completions.create(
-            model=self.model, messages=messages
-        )
+    async def stream(self, messages, **options):
+        async with self._slot(messages, options):
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                timeout=self.timeout,
+                **options,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def _chat(self, messages, options: Dict):
+        async with self._slot(messages, options) as estimate:
+            with metrics.timer("llm_request_seconds", backend=self.name):
+                completion = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    timeout=self.timeout,
+                    **options,
+                )
+        usage = completion.usage
+        if usage is not None:
+            self.token_limiter.adjust(usage.total_tokens - estimate)
+            for kind in ("prompt", "completion"):
+                metrics.inc(
+                    "llm_tokens_total",
+                    getattr(usage, f"{kind}_tokens"),
+                    backend=self.name,
+                    kind=kind,
+                )
         return completion.choices[0].message.content
+
+    def _slot(self, messages, options: Dict):
+        completion_tokens = options.get("max_tokens") or self.completion_tokens
+        return _Slot(self, estimate_tokens(messages, completion_tokens))
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        from openai import APIStatusError
+
+        if isinstance(error, APIStatusError):
+            return error.status_code >= 500 or error.status_code in RETRYABLE_STATUS
+        return True
+
+    def _retry_after(self, error: Exception) -> Optional[float]:
+        # capped like the backoff, a long Retry-After must not park the request
+        from openai import APIStatusError
+
+        if not isinstance(error, APIStatusError):
+            return None
+        value = error.response.headers.get("retry-after")
+        try:
+            delay = float(value) if value is not None else None
+        except ValueError:
+            return None
+        return None if delay is None else min(max(delay, 0.0), self.backoff_max)
+
+    def _backoff(self, attempt: int) -> float:
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+
+class _Slot:
+    # waits for the rate limiters and a concurrency slot, recording queue time
+    def __init__(self, client: Client, estimate: int):
+        self.client = client
+        self.estimate = estimate
+
+    async def __aenter__(self) -> int:
+        client = self.client
+        queued = time.monotonic()
+        await client.request_limiter.acquire()
+        await client.token_limiter.acquire(self.estimate)
+        await client.semaphore.acquire()
+        metrics.observe(
+            "llm_queue_wait_seconds", time.monotonic() - queued, backend=client.name
+        )
+        return self.estimate
+
+    async def __aexit__(self, *exc_info):
+        self.client.semaphore.release()
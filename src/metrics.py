@@ -0,0 +1,247 @@
+import contextvars
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext, suppress
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+LOG_TIMINGS = ENABLED and os.getenv("METRICS_LOG", "0") == "1"
+# a SQLite file the API workers of one server publish their counts to
+SHARED_PATH = os.getenv("METRICS_PATH", "")
+PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "1"))
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS = {
+    "problem_stage_seconds": ("histogram", "Time spent in each problem stage."),
+    "complexity_guard_total": ("counter", "Complexity guard triggers by action."),
+    "llm_request_seconds": ("histogram", "Latency of single LLM completions."),
+    "llm_requests_total": ("counter", "LLM chat calls by outcome."),
+    "llm_retries_total": ("counter", "LLM completions retried after an error."),
+    "llm_queue_wait_seconds": ("histogram", "Wait for a rate limit and LLM slot."),
+    "llm_hedges_total": ("counter", "Hedged LLM requests, started and won."),
+    "llm_tokens_total": ("counter", "Tokens reported by the LLM provider."),
+    "llm_invalid_total": ("counter", "LLM contents rejected, retried or kept."),
+    "http_request_seconds": ("histogram", "API request latency."),
+    "pool_problems": ("gauge", "Problems waiting in the pool."),
+}
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = Lock()
+_counters: Dict[Key, float] = {}
+# per bucket counts with a final +Inf bucket, then the sum of observations
+_histograms: Dict[Key, List[float]] = {}
+_gauges: Dict[Key, float] = {}
+_trace: contextvars.ContextVar = contextvars.ContextVar("metrics_trace", default=None)
+_disabled = nullcontext()
+
+_process = uuid.uuid4().hex
+_store_lock = Lock()
+_connection: Optional[sqlite3.Connection] = None
+_publisher: Optional[threading.Thread] = None
+_stopped = threading.Event()
+
+
+def _key(name: str, labels: Dict) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    if ENABLED:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        histogram[bisect_left(BUCKETS, value)] += 1
+        histogram[-1] += value
+    trace = _trace.get()
+    if trace is not None:
+        trace.append({"metric": name, **labels, "seconds": round(value, 6)})
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name: str, labels: Dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+def timer(name: str, **labels):
+    return _Timer(name, labels) if ENABLED else _disabled
+
+
+@contextmanager
+def tracing(trace: Optional[List[Dict]]):
+    # observations inside the block are also appended to trace, for timing logs
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def drain() -> Tuple[Dict, Dict]:
+    # worker processes hand their counters and histograms over to the API process
+    with _lock:
+        snapshot = (dict(_counters), dict(_histograms))
+        _counters.clear()
+        _histograms.clear()
+    return snapshot
+
+
+def _add(counters: Dict, histograms: Dict, snapshot: Tuple[Dict, Dict]):
+    for key, value in snapshot[0].items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in snapshot[1].items():
+        histogram = histograms.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            histogram[i] += value
+
+
+def merge(snapshot: Tuple[Dict, Dict], trace: Optional[List[Dict]] = None):
+    with _lock:
+        _add(_counters, _histograms, snapshot)
+    current = _trace.get()
+    if trace and current is not None:
+        current.extend(trace)
+
+
+def _connect() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(SHARED_PATH, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots "
+            "(process TEXT PRIMARY KEY, snapshot BLOB NOT NULL)"
+        )
+    return _connection
+
+
+def publish():
+    # counts of a process only grow and its row outlives it, so the sum over
+    # rows never drops when a worker is replaced
+    with _lock:
+        snapshot = pickle.dumps((_counters, _histograms))
+    with _store_lock:
+        db = _connect()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?)", (_process, snapshot)
+            )
+
+
+def _publish_loop():
+    while not _stopped.wait(PUBLISH_SECONDS):
+        try:
+            publish()
+        except sqlite3.Error as e:
+            print(f"Metrics: Error: {e}")
+
+
+def start():
+    global _publisher
+    if not ENABLED or not SHARED_PATH or _publisher is not None:
+        return
+    _stopped.clear()
+    _publisher = threading.Thread(target=_publish_loop, daemon=True)
+    _publisher.start()
+
+
+def stop():
+    global _publisher, _connection
+    if _publisher is None:
+        return
+    _stopped.set()
+    _publisher.join()
+    _publisher = None
+    publish()
+    with _store_lock:
+        _connection.close()
+        _connection = None
+
+
+def reset(path: str):
+    # counts start over with the server, as they do with a single process
+    for suffix in ("", "-wal", "-shm"):
+        with suppress(FileNotFoundError):
+            os.remove(path + suffix)
+
+
+def _shared() -> Tuple[Dict, Dict]:
+    publish()
+    with _store_lock:
+        rows = _connect().execute("SELECT snapshot FROM snapshots").fetchall()
+    counters, histograms = {}, {}
+    for (data,) in rows:
+        _add(counters, histograms, pickle.loads(data))
+    return counters, histograms
+
+
+def _labels(labels, extra: str = "") -> str:
+    pairs = [f'{label}="{value}"' for label, value in labels]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render() -> str:
+    # Prometheus text exposition format; with SHARED_PATH, counters and
+    # histograms sum every worker, gauges are those of the answering one
+    if ENABLED and SHARED_PATH:
+        counters, histograms = _shared()
+    else:
+        with _lock:
+            counters = dict(_counters)
+            histograms = {key: list(values) for key, values in _histograms.items()}
+    samples = {"counter": counters, "histogram": histograms, "gauge": dict(_gauges)}
+    lines = []
+    for name, (kind, help) in METRICS.items():
+        series = sorted(
+            (key, value) for key, value in samples[kind].items() if key[0] == name
+        )
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (_, labels), value in series:
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), value[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,42 @@
+import os
+from functools import lru_cache
+from typing import Callable, Sequence, Tuple
+
+import numpy as np
+import sympy as sp
+
+
+@lru_cache(maxsize=int(os.getenv("LAMBDIFY_CACHE_SIZE", "1024")))
+def _compile(expr: sp.Expr, symbols: Tuple[sp.Symbol, ...]) -> Callable:
+    # SymPy expressions hash structurally, so equal trees share one function
+    return sp.lambdify(symbols, expr, modules="numpy")
+
+
+def compile(expr: sp.Expr, symbols: Sequence[sp.Symbol] = ()) -> Callable:
+    return _compile(expr, tuple(symbols))
+
+
+def evaluate(
+    expr: sp.Expr,
+    symbols: Sequence[sp.Symbol],
+    points: Sequence[np.ndarray],
+    samples: int,
+) -> np.ndarray:
+    # constants compile to a function without arguments, the value is broadcast
+    values = compile(expr, symbols)(*points)
+    return np.broadcast_to(np.asarray(values, dtype=complex), (samples,))
+
+
+def evaluate_constant(expr: sp.Expr) -> sp.Number:
+    value = complex(compile(expr)())
+    if value.imag == 0:
+        return sp.Float(value.real)
+    return sp.Float(value.real) + sp.Float(value.imag) * sp.I
+
+
+def cache_info():
+    return _compile.cache_info()
+
+
+def cache_clear():
+    _compile.cache_clear()
@@ -0,0 +1,112 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+from src.differential import is_generatable, problem_classes
+from src.executor import executor
+from src.problem import generate_content
+from src.record import ProblemRecord
+from src.store import PoolStore, create_store
+
+
+async def generate(
+    topic_id: int,
+    exclude: Optional[Set[str]] = None,
+    level: Optional[int] = None,
+    difficulty: Optional[int] = None,
+) -> ProblemRecord:
+    record = (
+        await executor.generate(
+            topic_id,
+            level=level,
+            min_difficulty=difficulty,
+            max_difficulty=difficulty,
+            exclude=exclude,
+        )
+    )[0]
+    # pooled problems are encoded once, off the request path
+    record = record.with_content(await generate_content(record.json()))
+    return record.with_body()
+
+
+class ProblemPool:
+    def __init__(
+        self,
+        low_watermark: int = int(os.getenv("POOL_LOW_WATERMARK", "2")),
+        high_watermark: int = int(os.getenv("POOL_HIGH_WATERMARK", "5")),
+        concurrency: int = int(os.getenv("POOL_CONCURRENCY", "4")),
+        retry_delay: float = float(os.getenv("POOL_RETRY_DELAY", "5")),
+        store: Optional[PoolStore] = None,
+    ):
+        if low_watermark < 0 or high_watermark < 0:
+            raise ValueError("Pool watermarks must be non-negative.")
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.high_watermark = high_watermark
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self.topics = [id for id in problem_classes if is_generatable(id)]
+        self.store = store if store is not None else create_store()
+        self.events: Dict[int, asyncio.Event] = {}
+        self.tasks: List[asyncio.Task] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.high_watermark > 0
+
+    def start(self):
+        if not self.enabled or self.tasks:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+        for topic_id in self.topics:
+            event = asyncio.Event()
+            event.set()
+            self.events[topic_id] = event
+            self.tasks.append(asyncio.create_task(self._refill(topic_id, semaphore)))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        self.events.clear()
+        # a persistent store keeps the problems for the next start
+        self.store.close()
+
+    def get(
+        self,
+        topic_id: int,
+        exclude: Optional[Set[str]] = None,
+        level: Optional[int] = None,
+        difficulty: Optional[int] = None,
+    ) -> Optional[ProblemRecord]:
+        if topic_id not in self.topics:
+            return None
+        problem = self.store.take(topic_id, exclude, level, difficulty)
+        if self.size(topic_id) < self.low_watermark and topic_id in self.events:
+            self.events[topic_id].set()
+        return problem
+
+    def size(self, topic_id: int) -> int:
+        return self.store.size(topic_id)
+
+    async def _refill(self, topic_id: int, semaphore: asyncio.Semaphore):
+        event = self.events[topic_id]
+        while True:
+            await event.wait()
+            event.clear()
+            # claims count problems other workers are generating right now
+            while (
+                claim := self.store.claim(topic_id, self.high_watermark)
+            ) is not None:
+                try:
+                    async with semaphore:
+                        problem = await generate(topic_id)
+                except asyncio.CancelledError:
+                    self.store.release(claim)
+                    raise
+                except Exception as e:
+                    self.store.release(claim)
+                    print(f"Pool: Error refilling topic {topic_id}: {e}")
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+                self.store.put(problem, claim)
@@ -1,69 +1,360 @@
+import asyncio
+import contextvars
+import json
+import os
+import random
 import sympy as sp
-from latex2sympy2 import latex2sympy
-from typing import List, Dict
-from src.llm import Client
-from openai.types.chat import (
-    ChatCompletionSystemMessageParam,
-    ChatCompletionUserMessageParam,
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Callable, List, Dict, Optional, Set, Tuple
+from src.cache import ContentCache
+from src.check import check_answer
+from src import metrics
+from src.dedup import canonical_key
+from src.numeric import evaluate_constant
+from src.record import ProblemRecord
+from src.router import Router, create_client
+from src.signing import sign
+from src.utils import SpRand, deadline_passed, expression_depth, time_limit
+
+_client: Optional[Router] = None
+content_cache = ContentCache()
+# canonical keys a new problem must not have, see excluding()
+_excluded: contextvars.ContextVar = contextvars.ContextVar("excluded", default=None)
+# stage budgets are off, see exact()
+_exact: contextvars.ContextVar = contextvars.ContextVar("exact", default=False)
+
+STAGE_SECONDS = "problem_stage_seconds"
+GUARD_TOTAL = "complexity_guard_total"
+INVALID_TOTAL = "llm_invalid_total"
+STAGE_BUDGET = float(os.getenv("CAS_STAGE_BUDGET", "2"))
+WRAP_ATTEMPTS = int(os.getenv("LLM_WRAP_ATTEMPTS", "3"))
+JSON_FORMAT = {"type": "json_object"}
+# a seed holds the position of its region above SEED_BITS random bits
+SEED_BITS = 32
+
+# (level, difficulty, weight, sampler), the sampler draws the inputs of one region
+Region = Tuple[int, int, float, Callable[[random.Random], Dict]]
+
+SYSTEM_PROMPT = (
+    "You are a math teacher creating context-rich math problems. "
+    "Wrap the given expression in a short real-world context. "
+    "Embed the expression verbatim as inline LaTeX ($...$), "
+    "do not solve it or state the answer."
 )
 
-client = Client()
+
+class ComplexityError(TimeoutError):
+    pass
+
+
+class DuplicateError(Exception):
+    pass
+
+
+@contextmanager
+def excluding(keys: Optional[Set[str]]):
+    # problems built inside the block raise DuplicateError for these keys
+    token = _excluded.set(keys)
+    try:
+        yield
+    finally:
+        _excluded.reset(token)
+
+
+@contextmanager
+def exact():
+    # problems built inside the block depend on their inputs alone, not on load
+    token = _exact.set(True)
+    try:
+        yield
+    finally:
+        _exact.reset(token)
+
+
+def get_client() -> Router:
+    # built on first use so importing this module stays cheap
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def clean_content(content: str) -> str:
+    content = content.replace("```latex", "")
+    content = content.replace("```", "")
+    return content.strip('"')
 
 
 class Problem:
+    topic_id: int = -1
     name: str = ""
     description: str = ""
     level: int = 0
     difficulty: int = 0
     tags: List[str] = []
     content: str = ""
+    seed: Optional[int] = None
+    # False once a stage fell back on its budget, the seed then gives another answer
+    replayable: bool = True
+
+    # completion budget of the LLM context, on top of the embedded expression
+    content_tokens: int = 200
+
+    # complexity guard, None disables a limit
+    max_ops: Optional[int] = None
+    max_depth: Optional[int] = None
+    stage_budget: Optional[float] = None
+
+    # small, fixed input spaces solve and render every distinct expression once
+    # per process, later instances copy the result from the class table
+    use_table: bool = False
 
     expression: sp.Basic
     symbols: List[sp.Symbol]
 
     def __init__(self):
-        self.steps = self.solve_steps()
-        self.answer = self.solve()
+        # duplicates are rejected on the expression alone, before any solving
+        excluded = _excluded.get()
+        if excluded and self.canonical_key() in excluded:
+            raise DuplicateError(f"Duplicate expression: {self.expression}")
+        # helper problems built while solving are not checked, they may share
+        # the key of a problem of another topic
+        with excluding(None):
+            if self.use_table:
+                self._from_table()
+            else:
+                self._solve()
+
+    def _solve(self):
+        self.check_complexity()
+        with self._stage("solve_steps"):
+            self.steps = self.solve_steps()
+        with self._stage("solve"):
+            self.answer = self.solve()
+
+    @classmethod
+    def render_table(cls) -> Dict[sp.Basic, Tuple]:
+        if "_render_table" not in cls.__dict__:
+            cls._render_table = {}
+        return cls._render_table
+
+    @classmethod
+    def table_inputs(cls):
+        # one draw per region, classes with random regions list their inputs
+        for region in cls.input_regions():
+            yield region[3](SpRand.rng)
 
-    @staticmethod
-    def generate_random_inputs() -> Dict:
+    @classmethod
+    def precompute(cls) -> int:
+        for inputs in cls.table_inputs():
+            cls(**inputs)
+        return len(cls.render_table())
+
+    def _from_table(self):
+        table = self.render_table()
+        entry = table.get(self.expression)
+        if entry is None:
+            self._solve()
+            self.record()
+            if self.replayable:
+                rendered = MappingProxyType(dict(self._render_cache[1]))
+                table[self.expression] = (tuple(self.steps), self.answer, rendered)
+            return
+        steps, self.answer, rendered = entry
+        self.steps = list(steps)
+        self._render_cache = (self.expression, dict(rendered))
+
+    def check_complexity(self):
+        too_many_ops = (
+            self.max_ops is not None and sp.count_ops(self.expression) > self.max_ops
+        )
+        too_deep = (
+            self.max_depth is not None
+            and expression_depth(self.expression) > self.max_depth
+        )
+        if too_many_ops or too_deep:
+            metrics.inc(GUARD_TOTAL, topic=self.topic_id, action="rejected")
+            raise ComplexityError(f"Expression too complex: {self.expression}")
+
+    @contextmanager
+    def _stage(self, stage: str):
+        # a stage over budget makes the inputs unusable, the caller resamples
+        with metrics.timer(STAGE_SECONDS, stage=stage, topic=self.topic_id):
+            try:
+                with time_limit(self.budget()):
+                    yield
+            except TimeoutError:
+                if self.budget() is None or deadline_passed():
+                    raise
+                metrics.inc(GUARD_TOTAL, topic=self.topic_id, action="resampled")
+                raise ComplexityError(f"{stage} exceeded {self.stage_budget}s")
+
+    @classmethod
+    def input_regions(cls) -> List[Region]:
         raise NotImplementedError("Subclasses must implement this method.")
 
+    @classmethod
+    def region_list(cls) -> List[Region]:
+        # built once per class, subclasses get their own list
+        if "_region_list" not in cls.__dict__:
+            cls._region_list = list(cls.input_regions())
+        return cls._region_list
+
+    @classmethod
+    def region_index(cls) -> Dict[Tuple[int, int], List[int]]:
+        # positions in region_list by (level, difficulty)
+        if "_region_index" not in cls.__dict__:
+            index = {}
+            for position, region in enumerate(cls.region_list()):
+                index.setdefault((region[0], region[1]), []).append(position)
+            cls._region_index = index
+        return cls._region_index
+
+    @classmethod
+    def draw_seed(
+        cls,
+        rng: Optional[random.Random] = None,
+        level: Optional[int] = None,
+        min_difficulty: Optional[int] = None,
+        max_difficulty: Optional[int] = None,
+    ) -> int:
+        # the region is chosen first and kept in the seed, so the seed alone
+        # names the problem whatever filters it was drawn under
+        rng = rng or SpRand.rng
+        regions = cls.region_list()
+        positions = [
+            position
+            for (region_level, difficulty), group in cls.region_index().items()
+            if (level is None or region_level == level)
+            and (min_difficulty is None or difficulty >= min_difficulty)
+            and (max_difficulty is None or difficulty <= max_difficulty)
+            for position in group
+        ]
+        if not positions:
+            raise ValueError(
+                f"No problem of topic {cls.topic_id} matches the level and "
+                "difficulty filter."
+            )
+        weights = [regions[position][2] for position in positions]
+        position = rng.choices(positions, weights=weights)[0]
+        return position << SEED_BITS | rng.getrandbits(SEED_BITS)
+
+    @classmethod
+    def seed_inputs(cls, seed: int) -> Dict:
+        regions = cls.region_list()
+        position = seed >> SEED_BITS
+        if seed < 0 or position >= len(regions):
+            raise ValueError(f"Seed {seed} is not a problem of topic {cls.topic_id}.")
+        return regions[position][3](random.Random(seed & (1 << SEED_BITS) - 1))
+
+    @classmethod
+    def generate_random_inputs(
+        cls,
+        rng: Optional[random.Random] = None,
+        level: Optional[int] = None,
+        min_difficulty: Optional[int] = None,
+        max_difficulty: Optional[int] = None,
+    ) -> Dict:
+        return cls.seed_inputs(
+            cls.draw_seed(rng, level, min_difficulty, max_difficulty)
+        )
+
+    @classmethod
+    def from_seed(cls, seed: int) -> "Problem":
+        # the same seed always gives the same problem, replay it under exact()
+        problem = cls(**cls.seed_inputs(seed))
+        problem.seed = seed
+        return problem
+
     def solve_steps(self):
         raise NotImplementedError("Subclasses must implement this method.")
 
     def solve(self):
         raise NotImplementedError("Subclasses must implement this method.")
 
-    def check(self, answer):
-        try:
-            answer = latex2sympy(answer)
-        except Exception as e:
-            print(e)
-            return False
-        return sp.simplify(answer).equals(self.evaluate_sym())
+    def budget(self) -> Optional[float]:
+        return None if _exact.get() else self.stage_budget
+
+    def replay_seed(self) -> Optional[int]:
+        return self.seed if self.replayable else None
+
+    def check(self, answer, budget: Optional[float] = None):
+        return check_answer(self.evaluate_sym(), answer, budget)
+
+    def token(self):
+        return self._cached(
+            "token",
+            lambda: sign({"topic_id": self.topic_id, "answer": self.answer_source()}),
+        )
+
+    def answer_source(self):
+        return self._cached("answer_source", lambda: sp.srepr(self.answer))
+
+    def _cached(self, key: str, compute):
+        # rendered values are derived from the expression, recompute if it changes
+        cache = self.__dict__.get("_render_cache")
+        if cache is None or cache[0] is not self.expression:
+            cache = (self.expression, {})
+            self._render_cache = cache
+        if key not in cache[1]:
+            cache[1][key] = compute()
+        return cache[1][key]
 
     def evaluate_sym(self):
-        return sp.simplify(self.answer)
+        def simplify():
+            with metrics.timer(STAGE_SECONDS, stage="simplify", topic=self.topic_id):
+                try:
+                    with time_limit(self.budget()):
+                        return sp.simplify(self.answer)
+                except TimeoutError:
+                    if self.budget() is None or deadline_passed():
+                        raise
+                    # the unsimplified answer is still correct, just less tidy
+                    metrics.inc(GUARD_TOTAL, topic=self.topic_id, action="unsimplified")
+                    self.replayable = False
+                    return self.answer
+
+        return self._cached("symbolic", simplify)
 
     def evaluate_num(self):
-        return self.answer.evalf()
+        def compute():
+            # constant answers run through a cached compiled function
+            if self.answer.free_symbols or self.answer.is_Number:
+                return self.answer.evalf()
+            return evaluate_constant(self.answer)
+
+        return self._cached("numeric", compute)
+
+    def canonical_key(self):
+        return self._cached("key", lambda: canonical_key(self.expression))
 
     def latex_expression(self):
-        return sp.latex(self.expression)
+        return self._cached("latex_expression", lambda: sp.latex(self.expression))
 
     def latex_solution(self):
-        return [sp.latex(step) for step in self.steps]
+        solution = self._cached(
+            "latex_solution", lambda: tuple(sp.latex(step) for step in self.steps)
+        )
+        return list(solution)
 
     def latex_answer(self):
-        symbolic = sp.latex(self.evaluate_sym())
-        numeric = sp.latex(self.evaluate_num())
-        if numeric == symbolic:
-            numeric = None
-        return {"symbolic": symbolic, "numeric": numeric}
+        def render():
+            symbolic = sp.latex(self.evaluate_sym())
+            numeric = sp.latex(self.evaluate_num())
+            if numeric == symbolic:
+                numeric = None
+            return {"symbolic": symbolic, "numeric": numeric}
+
+        return dict(self._cached("latex_answer", render))
 
     def json(self):
+        with metrics.timer(STAGE_SECONDS, stage="json", topic=self.topic_id):
+            return self._json()
+
+    def _json(self):
         return {
+            "topic_id": self.topic_id,
             "name": self.name,
             "description": self.description,
             "level": self.level,
@@ -73,42 +364,207 @@ class Problem:
             "solution": self.latex_solution(),
             "answer": self.latex_answer(),
             "content": self.content,
+            "key": self.canonical_key(),
+            "token": self.token(),
+            "seed": self.replay_seed(),
         }
 
+    def record(self) -> ProblemRecord:
+        with metrics.timer(STAGE_SECONDS, stage="record", topic=self.topic_id):
+            answer = self.latex_answer()
+            return ProblemRecord(
+                topic_id=self.topic_id,
+                level=self.level,
+                difficulty=self.difficulty,
+                expression=self.latex_expression(),
+                solution=tuple(self.latex_solution()),
+                answer=answer["symbolic"],
+                numeric=answer["numeric"],
+                key=self.canonical_key(),
+                token=self.token(),
+                answer_source=self.answer_source(),
+                seed=self.replay_seed(),
+                content=self.content,
+            )
+
     async def wrap_with_llm(self):
-        system_prompt = (
-            "You are a math teacher creating context-rich math problems. "
-            "Each problem should have a real-world context. "
-            "The raw expression and answer of the problem are given."
-            "Please wrap the problem with meaningful context."
-            "Please output one raw latex string only, the problem content."
-        )
-        user_prompt = (
-            f"Generate one math problem with the following details:\n"
-            f"{self.__repr__()}"
+        self.content = await generate_content(self.json())
+
+    def __repr__(self):
+        return describe(self.json())
+
+
+def describe(data: Dict) -> str:
+    lines = [
+        f"Problem: {data['name']}",
+        f"    Description: {data['description']}",
+        f"    Level: {data['level']}",
+        f"    Difficulty: {data['difficulty']}",
+        f"    Tags: {data['tags']}",
+        f"    Expression: {data['expression']}",
+        f"    Solution: {data['solution']}",
+        f"    Answer: {data['answer']}",
+        f"    Content: {data['content']}",
+    ]
+    return "\n".join(lines)
+
+
+async def generate_content(data: Dict) -> str:
+    key = content_cache.key(data)
+    content = content_cache.lookup(key)
+    if content is None:
+        with metrics.timer(STAGE_SECONDS, stage="wrap", topic=data["topic_id"]):
+            content, valid = await _chat_one(data)
+        if valid:
+            content_cache.add(key, content)
+    return content
+
+
+async def stream_content(data: Dict):
+    key = content_cache.key(data)
+    content = content_cache.lookup(key)
+    if content is not None:
+        yield content
+        return
+    chunks = []
+    messages = _content_messages(data, structured=False)
+    async for chunk in get_client().stream(messages, max_tokens=content_budget(data)):
+        chunks.append(chunk)
+        yield chunk
+    # streamed text cannot be retried once sent, but only valid text is kept
+    content = clean_content("".join(chunks))
+    if valid_content(content, data):
+        content_cache.add(key, content)
+
+
+def prompt_fields(data: Dict) -> Dict:
+    # the solution and answer do not shape the context, leaving them out saves tokens
+    return {
+        "topic": data["name"],
+        "level": data["level"],
+        "difficulty": data["difficulty"],
+        "expression": data["expression"],
+    }
+
+
+def content_budget(data: Dict) -> int:
+    # class level settings are looked up, importing them here avoids a cycle
+    from src.differential import problem_classes
+
+    # the expression is echoed in the content, LaTeX runs ~3 characters a token
+    tokens = problem_classes[data["topic_id"]].content_tokens
+    return tokens + len(data["expression"]) // 3
+
+
+def valid_content(content, data: Dict) -> bool:
+    if not isinstance(content, str) or not content.strip():
+        return False
+    expression = "".join(data["expression"].split())
+    return expression in "".join(content.split())
+
+
+def parse_json(response: str):
+    return json.loads(response.replace("```json", "").replace("```", ""))
+
+
+def _reject(data: Dict, reason: str, outcome: str = "retried"):
+    print(f"Wrap: Error: {reason} for topic {data['topic_id']}")
+    metrics.inc(INVALID_TOTAL, topic=data["topic_id"], outcome=outcome)
+
+
+async def _chat_one(data: Dict) -> Tuple[str, bool]:
+    # without a valid attempt the last content is kept, the problem is still served
+    messages = _content_messages(data)
+    content = ""
+    for _ in range(WRAP_ATTEMPTS):
+        response = await get_client().chat(
+            messages, max_tokens=content_budget(data), response_format=JSON_FORMAT
         )
-        messages = [
-            ChatCompletionSystemMessageParam(
-                {"role": "system", "content": system_prompt}
-            ),
-            ChatCompletionUserMessageParam({"role": "user", "content": user_prompt}),
-        ]
+        try:
+            content = parse_json(response)["content"]
+        except (ValueError, KeyError, TypeError):
+            _reject(data, "malformed response")
+            continue
+        if valid_content(content, data):
+            return content.strip(), True
+        _reject(data, "expression missing from content")
+    content = content.strip() if isinstance(content, str) else ""
+    _reject(data, "no valid content", "kept" if content else "empty")
+    return content, False
 
-        self.content = await client.chat(messages)
-        self.content = self.content.replace("```latex", "")
-        self.content = self.content.replace("```", "")
-        self.content = self.content.strip('"')
 
-    def __repr__(self):
-        lines = [
-            f"Problem: {self.name}",
-            f"    Description: {self.description}",
-            f"    Level: {self.level}",
-            f"    Difficulty: {self.difficulty}",
-            f"    Tags: {self.tags}",
-            f"    Expression: {self.latex_expression()}",
-            f"    Solution: {self.latex_solution()}",
-            f"    Answer: {self.latex_answer()}",
-            f"    Content: {self.content}",
-        ]
-        return "\n".join(lines)
+def _content_messages(data: Dict, structured: bool = True) -> List:
+    if structured:
+        output = 'Reply with a JSON object {"content": "<problem text>"}.'
+    else:
+        output = "Reply with the problem text only."
+    return [
+        {"role": "system", "content": f"{SYSTEM_PROMPT} {output}"},
+        {"role": "user", "content": json.dumps(prompt_fields(data))},
+    ]
+
+
+async def wrap_many_with_llm(
+    problems: List[Dict], pack_size: int = 1, concurrency: int = 4
+):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def wrap_pack(pack: List[Dict]):
+        async with semaphore:
+            contents = await _chat_pack(pack) if len(pack) > 1 else [None]
+            # only the problems without a valid content are wrapped again, one by one
+            for problem, content in zip(pack, contents):
+                if content is None:
+                    try:
+                        problem["content"] = await generate_content(problem)
+                    except Exception as e:
+                        # one problem without content must not fail the batch
+                        print(f"Wrap: Error: {e}")
+                        problem["content"] = ""
+                    continue
+                problem["content"] = content
+                content_cache.add(content_cache.key(problem), content)
+
+    missing = []
+    for problem in problems:
+        content = content_cache.lookup(content_cache.key(problem))
+        if content is None:
+            missing.append(problem)
+        else:
+            problem["content"] = content
+
+    packs = [missing[i : i + pack_size] for i in range(0, len(missing), pack_size)]
+    await asyncio.gather(*(wrap_pack(pack) for pack in packs))
+
+
+async def _chat_pack(pack: List[Dict]) -> List[Optional[str]]:
+    system_prompt = (
+        f'{SYSTEM_PROMPT} Reply with a JSON object {{"contents": [...]}} holding '
+        f"exactly {len(pack)} problem texts, in the given order."
+    )
+    user_prompt = json.dumps({"problems": [prompt_fields(data) for data in pack]})
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    try:
+        response = await get_client().chat(
+            messages,
+            max_tokens=sum(content_budget(data) for data in pack),
+            response_format=JSON_FORMAT,
+        )
+        contents = parse_json(response)["contents"]
+    except Exception as e:
+        print(f"Pack: Error: {e}")
+        return [None] * len(pack)
+    if not isinstance(contents, list) or len(contents) != len(pack):
+        print("Pack: Error: malformed response, wrapping individually")
+        return [None] * len(pack)
+    results = []
+    for data, content in zip(pack, contents):
+        if valid_content(content, data):
+            results.append(content.strip())
+        else:
+            _reject(data, "expression missing from content")
+            results.append(None)
+    return results
@@ -0,0 +1,54 @@
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional, Tuple
+
+from src.encoding import encode_json
+
+
+@dataclass(frozen=True, slots=True)
+class ProblemRecord:
+    # everything a served problem needs, rendered, without live SymPy objects
+    topic_id: int
+    level: int
+    difficulty: int
+    expression: str
+    solution: Tuple[str, ...]
+    answer: str
+    numeric: Optional[str]
+    key: str
+    token: str
+    # srepr of the answer, the token carries it to /check
+    answer_source: str
+    seed: Optional[int] = None
+    content: str = ""
+    # the encoded json payload, filled in for records that wait to be served
+    body: bytes = field(default=b"", repr=False, compare=False)
+
+    def with_content(self, content: str) -> "ProblemRecord":
+        return replace(self, content=content, body=b"")
+
+    def with_body(self) -> "ProblemRecord":
+        return replace(self, body=encode_json(self.json()))
+
+    def encoded(self) -> bytes:
+        return self.body or encode_json(self.json())
+
+    def json(self) -> Dict:
+        # class level texts are looked up, importing them here avoids a cycle
+        from src.differential import problem_classes
+
+        problem_class = problem_classes[self.topic_id]
+        return {
+            "topic_id": self.topic_id,
+            "name": problem_class.name,
+            "description": problem_class.description,
+            "level": self.level,
+            "difficulty": self.difficulty,
+            "tags": problem_class.tags,
+            "expression": self.expression,
+            "solution": list(self.solution),
+            "answer": {"symbolic": self.answer, "numeric": self.numeric},
+            "content": self.content,
+            "key": self.key,
+            "token": self.token,
+            "seed": self.seed,
+        }
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+from src import metrics
+from src.llm import Client
+
+
+class Backend:
+    def __init__(self, client: Client, alpha: float = 0.2):
+        self.client = client
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.inflight = 0
+
+    @property
+    def name(self) -> str:
+        return self.client.name
+
+    def score(self, error_penalty: float) -> float:
+        # untried backends score 0 so every backend gets measured, one that has
+        # only failed so far is assumed to be as slow as its timeout
+        latency = self.latency
+        if latency is None:
+            latency = self.client.timeout if self.error_rate > 0 else 0.0
+        return latency * (1 + self.inflight) * (1 + error_penalty * self.error_rate)
+
+    def record(self, latency: Optional[float], error: bool):
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+        self.error_rate += self.alpha * (float(error) - self.error_rate)
+
+
+class Router:
+    def __init__(
+        self,
+        clients: List[Client],
+        hedge_delay: float = float(os.getenv("LLM_HEDGE_DELAY", "0")),
+        error_penalty: float = float(os.getenv("LLM_ERROR_PENALTY", "10")),
+    ):
+        if not clients:
+            raise ValueError("Router needs at least one client.")
+        self.backends = [Backend(client) for client in clients]
+        self.hedge_delay = hedge_delay
+        self.error_penalty = error_penalty
+
+    def pick(self, exclude: Sequence[Backend] = ()) -> Optional[Backend]:
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda backend: backend.score(self.error_penalty))
+
+    async def chat(self, messages, max_retries: int = 3, **options):
+        # a failed request moves on to the best backend not tried yet
+        tried = []
+        while True:
+            primary = self.pick(exclude=tried)
+            tried.append(primary)
+            try:
+                return await self._hedged(
+                    primary, tried, messages, max_retries, options
+                )
+            except Exception as e:
+                if self.pick(exclude=tried) is None:
+                    raise
+                print(f"Router: Error: {primary.name} failed, failing over: {e}")
+
+    async def _hedged(
+        self,
+        primary: Backend,
+        tried: List[Backend],
+        messages,
+        max_retries: int,
+        options: Dict,
+    ):
+        first = asyncio.create_task(self._chat(primary, messages, max_retries, options))
+        secondary = self.pick(exclude=tried)
+        if secondary is None or self.hedge_delay <= 0:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done and first.exception() is None:
+            return first.result()
+
+        # the primary is slow or failed, race it against a second backend
+        metrics.inc("llm_hedges_total", outcome="started")
+        tried.append(secondary)
+        second = asyncio.create_task(
+            self._chat(secondary, messages, max_retries, options)
+        )
+        pending = {first, second} - done
+        error = first.exception() if done else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            metrics.inc("llm_hedges_total", outcome="won")
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    async def stream(self, messages, **options):
+        # partial streams cannot be raced, so streaming only picks the best backend
+        backend = self.pick()
+        started = time.monotonic()
+        backend.inflight += 1
+        try:
+            async for chunk in backend.client.stream(messages, **options):
+                yield chunk
+        except Exception:
+            backend.record(None, True)
+            raise
+        else:
+            backend.record(time.monotonic() - started, False)
+        finally:
+            backend.inflight -= 1
+
+    async def _chat(self, backend: Backend, messages, max_retries: int, options: Dict):
+        started = time.monotonic()
+        backend.inflight += 1
+        try:
+            content = await backend.client.chat(messages, max_retries, **options)
+        except asyncio.CancelledError:
+            # a cancelled hedge still tells us the backend was at least this slow
+            backend.record(time.monotonic() - started, False)
+            raise
+        except Exception:
+            backend.record(None, True)
+            raise
+        else:
+            backend.record(time.monotonic() - started, False)
+            return content
+        finally:
+            backend.inflight -= 1
+
+
+def create_client(
+    providers: str = os.getenv("LLM_PROVIDERS", "openai:gpt-4o"),
+) -> Router:
+    # comma separated provider:model[@api_url], e.g.
+    # "openai:gpt-4o,ollama:llama3.1@http://localhost:11434/v1"
+    clients = []
+    for spec in providers.split(","):
+        spec, _, api_url = spec.strip().partition("@")
+        provider, _, model = spec.partition(":")
+        kwargs = {"provider": provider}
+        if model:
+            kwargs["model"] = model
+        if api_url:
+            kwargs["api_url"] = api_url
+        clients.append(Client(**kwargs))
+    return Router(clients)
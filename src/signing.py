@@ -0,0 +1,40 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+from typing import Dict
+
+# exported so CAS worker processes sign with the same key as the API process
+SECRET = os.environ.setdefault("PROBLEM_TOKEN_SECRET", secrets.token_hex(32))
+# identifies the key without revealing it, e.g. to version cached tokens
+SECRET_ID = hashlib.sha256(SECRET.encode()).hexdigest()[:8]
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(body: str) -> str:
+    digest = hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return _encode(digest)
+
+
+def sign(data: Dict) -> str:
+    body = _encode(json.dumps(data, separators=(",", ":")).encode())
+    return f"{body}.{_signature(body)}"
+
+
+def unsign(token: str) -> Dict:
+    try:
+        body, signature = token.split(".")
+    except ValueError:
+        raise ValueError("Malformed token")
+    if not hmac.compare_digest(signature, _signature(body)):
+        raise ValueError("Invalid token signature")
+    return json.loads(_decode(body))
@@ -0,0 +1,233 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import fields
+from typing import Deque, Dict, Optional, Set
+
+from src.record import ProblemRecord
+from src.signing import SECRET_ID
+
+
+class PoolStore:
+    # pooled problems, shared by every API worker that opens the same store;
+    # another backend, e.g. Redis, implements these methods
+    def put(self, record: ProblemRecord, claim: int):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def take(
+        self,
+        topic_id: int,
+        exclude: Optional[Set[str]] = None,
+        level: Optional[int] = None,
+        difficulty: Optional[int] = None,
+    ) -> Optional[ProblemRecord]:
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def size(self, topic_id: int) -> int:
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def claim(self, topic_id: int, limit: int) -> Optional[int]:
+        # reserves a slot for one more problem, None once stored and claimed
+        # problems reach the limit, so workers never generate past it together
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def release(self, claim: int):
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def close(self):
+        pass
+
+
+def dump(record: ProblemRecord) -> bytes:
+    # by field name, a record of another layout then fails to load instead of
+    # loading with its fields shifted
+    return pickle.dumps({f.name: getattr(record, f.name) for f in fields(record)})
+
+
+def load(data: bytes) -> ProblemRecord:
+    return ProblemRecord(**pickle.loads(data))
+
+
+def matches(
+    record: ProblemRecord,
+    exclude: Optional[Set[str]],
+    level: Optional[int],
+    difficulty: Optional[int],
+) -> bool:
+    if exclude and record.key in exclude:
+        return False
+    if level is not None and record.level != level:
+        return False
+    return difficulty is None or record.difficulty == difficulty
+
+
+class MemoryPoolStore(PoolStore):
+    def __init__(self):
+        self.problems: Dict[int, Deque[ProblemRecord]] = {}
+        self.claims: Dict[int, int] = {}
+        self.counter = 0
+
+    def put(self, record: ProblemRecord, claim: int):
+        self.release(claim)
+        self.problems.setdefault(record.topic_id, deque()).append(record)
+
+    def take(self, topic_id, exclude=None, level=None, difficulty=None):
+        problems = self.problems.get(topic_id, ())
+        for index, record in enumerate(problems):
+            if matches(record, exclude, level, difficulty):
+                del problems[index]
+                return record
+        return None
+
+    def size(self, topic_id: int) -> int:
+        return len(self.problems.get(topic_id, ()))
+
+    def claim(self, topic_id: int, limit: int) -> Optional[int]:
+        pending = sum(1 for claimed in self.claims.values() if claimed == topic_id)
+        if self.size(topic_id) + pending >= limit:
+            return None
+        self.counter += 1
+        self.claims[self.counter] = topic_id
+        return self.counter
+
+    def release(self, claim: int):
+        self.claims.pop(claim, None)
+
+
+class SQLitePoolStore(PoolStore):
+    def __init__(
+        self,
+        path: str,
+        claim_ttl: float = float(os.getenv("POOL_CLAIM_TTL", "120")),
+    ):
+        # claims of a worker that died expire after claim_ttl seconds
+        self.path = path
+        self.claim_ttl = claim_ttl
+        self.connection: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL lets workers read while another one writes
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS pool (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic_id INTEGER NOT NULL,
+                    secret TEXT NOT NULL,
+                    record BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS claims (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic_id INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS pool_topic ON pool (topic_id);
+                """)
+            # tokens signed with another secret would not verify, e.g. after a
+            # restart without PROBLEM_TOKEN_SECRET
+            with self.connection:
+                self.connection.execute(
+                    "DELETE FROM pool WHERE secret != ?", (SECRET_ID,)
+                )
+        return self.connection
+
+    def put(self, record: ProblemRecord, claim: int):
+        with self.lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT INTO pool (topic_id, secret, record) VALUES (?, ?, ?)",
+                    (record.topic_id, SECRET_ID, dump(record)),
+                )
+                db.execute("DELETE FROM claims WHERE id = ?", (claim,))
+
+    def take(self, topic_id, exclude=None, level=None, difficulty=None):
+        with self.lock:
+            db = self._connect()
+            rows = db.execute(
+                "SELECT id, record FROM pool WHERE topic_id = ? AND secret = ? "
+                "ORDER BY id",
+                (topic_id, SECRET_ID),
+            ).fetchall()
+            for id, data in rows:
+                try:
+                    record = load(data)
+                except Exception as e:
+                    # written by an incompatible version, drop it
+                    print(f"Pool store: Error: {e}")
+                    record = None
+                if record is not None and not matches(
+                    record, exclude, level, difficulty
+                ):
+                    continue
+                with db:
+                    deleted = db.execute("DELETE FROM pool WHERE id = ?", (id,))
+                # another worker may have taken it in the meantime
+                if deleted.rowcount and record is not None:
+                    return record
+        return None
+
+    def size(self, topic_id: int) -> int:
+        with self.lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT COUNT(*) FROM pool WHERE topic_id = ? AND secret = ?",
+                    (topic_id, SECRET_ID),
+                )
+                .fetchone()
+            )
+        return row[0]
+
+    def claim(self, topic_id: int, limit: int) -> Optional[int]:
+        now = time.time()
+        with self.lock:
+            db = self._connect()
+            # BEGIN IMMEDIATE serializes the count and the insert across workers
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("DELETE FROM claims WHERE expires_at < ?", (now,))
+                count = db.execute(
+                    "SELECT (SELECT COUNT(*) FROM pool WHERE topic_id = ? "
+                    "AND secret = ?) + (SELECT COUNT(*) FROM claims "
+                    "WHERE topic_id = ?)",
+                    (topic_id, SECRET_ID, topic_id),
+                ).fetchone()[0]
+                claim = None
+                if count < limit:
+                    claim = db.execute(
+                        "INSERT INTO claims (topic_id, expires_at) VALUES (?, ?)",
+                        (topic_id, now + self.claim_ttl),
+                    ).lastrowid
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return claim
+
+    def release(self, claim: int):
+        with self.lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM claims WHERE id = ?", (claim,))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def create_store(url: str = os.getenv("POOL_STORE", "")) -> PoolStore:
+    # "" or "memory" keeps the pool in the process, "sqlite:///path" shares it
+    if url in ("", "memory"):
+        return MemoryPoolStore()
+    scheme, _, path = url.partition("://")
+    if scheme == "sqlite" and path:
+        return SQLitePoolStore(path.removeprefix("/"))
+    raise ValueError("Unsupported pool store. Choose either memory or sqlite:///path.")
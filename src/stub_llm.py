@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+# OpenAI-compatible stand-in for local testing and benchmarks:
+#   STUB_LLM_LATENCY=0.5 uvicorn src.stub_llm:app --port 8001
+LATENCY = float(os.getenv("STUB_LLM_LATENCY", "0.2"))
+JITTER = float(os.getenv("STUB_LLM_JITTER", "0"))
+ERROR_RATE = float(os.getenv("STUB_LLM_ERROR_RATE", "0"))
+# chance that a content leaves out the expression and fails validation
+INVALID_RATE = float(os.getenv("STUB_LLM_INVALID_RATE", "0"))
+CONTENT = os.getenv("STUB_LLM_CONTENT", "A stub context for the problem")
+
+app = FastAPI()
+
+
+class ChatRequest(BaseModel):
+    model: str
+    messages: List[Dict]
+    stream: bool = False
+    max_tokens: Optional[int] = None
+    response_format: Optional[Dict] = None
+
+
+def reply(request: ChatRequest) -> str:
+    # the prompt is JSON, its expressions are echoed back so the contents validate
+    try:
+        prompt = json.loads(request.messages[-1]["content"])
+        problems = prompt.get("problems", [prompt])
+        expressions = [problem["expression"] for problem in problems]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        prompt, expressions = {}, [""]
+    contents = [
+        CONTENT if random.random() < INVALID_RATE else f"{CONTENT} ${expression}$."
+        for expression in expressions
+    ]
+    if request.response_format is None:
+        return contents[0]
+    if "problems" in prompt:
+        return json.dumps({"contents": contents})
+    return json.dumps({"content": contents[0]})
+
+
+def completion(request: ChatRequest, content: str) -> Dict:
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in request.messages) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def chunk(request: ChatRequest, delta: Dict, finish_reason=None) -> str:
+    data = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(data)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatRequest):
+    await asyncio.sleep(max(0.0, LATENCY + random.uniform(-JITTER, JITTER)))
+    if random.random() < ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Stub failure")
+    if not request.stream:
+        return completion(request, reply(request))
+
+    async def events():
+        yield chunk(request, {"role": "assistant", "content": ""})
+        for word in reply(request).split(" "):
+            yield chunk(request, {"content": word + " "})
+        yield chunk(request, {}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -1,101 +1,250 @@
+import numpy as np
 import sympy as sp
 import random
-from typing import List
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from typing import List, Optional, Tuple
+
+# absolute deadlines of the active time limits, outermost first
+_deadlines: List[float] = []
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    # SIGALRM can only interrupt the main thread, elsewhere this is a no-op
+    if (
+        not seconds
+        or seconds <= 0
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def handler(signum, frame):
+        raise TimeoutError(f"Timed out after {seconds}s")
+
+    # nested limits never outlive an enclosing one, which is re-armed on exit
+    now = time.monotonic()
+    deadline = min([now + seconds] + _deadlines)
+    _deadlines.append(deadline)
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, max(deadline - now, 1e-6))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        _deadlines.pop()
+        if _deadlines:
+            remaining = _deadlines[-1] - time.monotonic()
+            signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-6))
+
+
+def deadline_passed() -> bool:
+    # lets code that recovers from its own time limit re-raise an outer one
+    return bool(_deadlines) and _deadlines[-1] <= time.monotonic()
+
+
+def expression_depth(expr: sp.Basic) -> int:
+    depth, level = 0, [expr]
+    while level:
+        depth += 1
+        level = [arg for node in level for arg in node.args]
+    return depth
+
+
+@lru_cache(maxsize=None)
+def primes(min_val: int, max_val: int) -> Tuple[int, ...]:
+    # same range as sp.randprime: primes in [min_val, max_val)
+    return tuple(sp.primerange(max(min_val, 2), max_val))
+
+
+def _pow(power, evaluate=False):
+    return sp.Pow(SYMBOLS["a"], power)
+
+
+def _linear(symbol, evaluate=False, constant=None):
+    # unbound, every call draws a new constant, see SpRand.bind
+    return (SpRand.constant() if constant is None else constant) * symbol
+
+
+SYMBOLS = {name: sp.Symbol(name) for name in "a b r s t u v w x y z".split()}
+
+# (function, difficulty)
+FUNCTIONS = [
+    (_linear, 1),
+    (sp.exp, 2),
+    (sp.log, 2),
+    (sp.sin, 3),
+    (sp.cos, 3),
+    (sp.tan, 3),
+    (sp.cot, 4),
+    (sp.sec, 4),
+    (sp.csc, 4),
+    (sp.atan, 5),
+    (sp.asin, 5),
+    (sp.acos, 5),
+    (_pow, 5),
+]
 
 
 class SpRand:
+    # shared generators, reseed both with SpRand.seed() for reproducible runs
+    rng = random.Random()
+    np_rng = np.random.default_rng()
+
+    # (kind, difficulty [1-3]) and its weight
+    CONSTANT_KINDS = ["integer", "rational", "pi", "e"]
+    CONSTANT_DIFFICULTIES = [1, 2, 2, 3]
+    CONSTANT_WEIGHTS = [0.5, 0.3, 0.1, 0.1]
+
     @staticmethod
-    def integer_pos(max_val=100):
-        return sp.Integer(sp.randprime(1, max_val))
+    def seed(seed: Optional[int] = None):
+        SpRand.rng.seed(seed)
+        SpRand.np_rng = np.random.default_rng(seed)
 
     @staticmethod
-    def integer(min_val=-100, max_val=100):
-        return sp.Integer(sp.randprime(min_val, max_val))
+    def prime(min_val=1, max_val=100, rng: Optional[random.Random] = None):
+        table = primes(min_val, max_val)
+        if not table:
+            raise ValueError(f"No primes in [{min_val}, {max_val}).")
+        return (rng or SpRand.rng).choice(table)
 
     @staticmethod
-    def rational_pos(max_val=100):
-        return sp.Rational(sp.randprime(1, max_val), sp.randprime(1, max_val))
+    def integer_pos(max_val=100, rng: Optional[random.Random] = None):
+        return sp.Integer(SpRand.prime(1, max_val, rng))
 
     @staticmethod
-    def rational(min_val=-100, max_val=100):
-        return sp.Rational(sp.randprime(min_val, max_val), sp.randprime(1, max_val))
+    def integer(min_val=-100, max_val=100, rng: Optional[random.Random] = None):
+        return sp.Integer(SpRand.prime(min_val, max_val, rng))
 
     @staticmethod
-    def constant_pos_with_difficulty():
-        # first element is the function to generate the value
-        # second element is the difficulty level [1-3]
-        population = [
-            (SpRand.integer_pos, 1),
-            (SpRand.rational_pos, 2),
-            (lambda: sp.pi, 2),
-            (lambda: sp.E, 3),
-        ]
-        weights = [0.5, 0.3, 0.1, 0.1]
+    def rational_pos(max_val=100, rng: Optional[random.Random] = None):
+        return sp.Rational(SpRand.prime(1, max_val, rng), SpRand.prime(1, max_val, rng))
 
-        choice = random.choices(population, weights=weights, k=1)[0]
-        return choice[0](), choice[1]
+    @staticmethod
+    def rational(min_val=-100, max_val=100, rng: Optional[random.Random] = None):
+        return sp.Rational(
+            SpRand.prime(min_val, max_val, rng), SpRand.prime(1, max_val, rng)
+        )
+
+    @staticmethod
+    def _constant_of_kind(kind: str, rng: Optional[random.Random] = None):
+        if kind == "integer":
+            return SpRand.integer_pos(rng=rng)
+        if kind == "rational":
+            return SpRand.rational_pos(rng=rng)
+        if kind == "pi":
+            return sp.pi
+        return sp.E
+
+    @staticmethod
+    def constant_values(kind: str) -> List[sp.Expr]:
+        # every value _constant_of_kind can return
+        table = primes(1, 100)
+        if kind == "integer":
+            return [sp.Integer(p) for p in table]
+        if kind == "rational":
+            return list(dict.fromkeys(sp.Rational(p, q) for p in table for q in table))
+        if kind == "pi":
+            return [sp.pi]
+        return [sp.E]
 
     @staticmethod
-    def constant_pos():
-        population = [
-            SpRand.integer_pos,
-            SpRand.rational_pos,
-            lambda: sp.pi,
-            lambda: sp.E,
-        ]
-        weights = [0.5, 0.3, 0.1, 0.1]
+    def constant_pos_with_difficulty(rng: Optional[random.Random] = None):
+        rng = rng or SpRand.rng
+        index = rng.choices(
+            range(len(SpRand.CONSTANT_KINDS)), weights=SpRand.CONSTANT_WEIGHTS, k=1
+        )[0]
+        value = SpRand._constant_of_kind(SpRand.CONSTANT_KINDS[index], rng)
+        return value, SpRand.CONSTANT_DIFFICULTIES[index]
 
-        choice = random.choices(population, weights=weights, k=1)[0]
-        return choice()
+    @staticmethod
+    def constant_regions():
+        # (difficulty, weight, sampler) for every outcome of constant_with_difficulty
+        regions = []
+        for kind, difficulty, weight in zip(
+            SpRand.CONSTANT_KINDS,
+            SpRand.CONSTANT_DIFFICULTIES,
+            SpRand.CONSTANT_WEIGHTS,
+        ):
+            for sign in (1, -1):
+                sampler = partial(SpRand._signed_constant, kind, sign)
+                regions.append((difficulty + (sign < 0), weight / 2, sampler))
+        return regions
+
+    @staticmethod
+    def _signed_constant(kind: str, sign: int, rng: Optional[random.Random] = None):
+        return sign * SpRand._constant_of_kind(kind, rng)
+
+    @staticmethod
+    def constant_pos(rng: Optional[random.Random] = None):
+        return SpRand.constant_pos_with_difficulty(rng)[0]
 
     @staticmethod
-    def constant_with_difficulty():
-        # first element is the function to generate the value
-        # second element is the difficulty level [1-4]
-        sign = random.choice([-1, 1])
+    def constant_with_difficulty(rng: Optional[random.Random] = None):
+        # difficulty level [1-4], negative values are one level harder
+        rng = rng or SpRand.rng
+        sign = rng.choice([-1, 1])
         difficulty_offset = 1 if sign < 0 else 0
-        value, difficulty = SpRand.constant_pos_with_difficulty()
+        value, difficulty = SpRand.constant_pos_with_difficulty(rng)
         return sign * value, difficulty + difficulty_offset
 
     @staticmethod
-    def constant():
-        sign = random.choice([-1, 1])
-        return sign * SpRand.constant_pos()
+    def constant(rng: Optional[random.Random] = None):
+        rng = rng or SpRand.rng
+        sign = rng.choice([-1, 1])
+        return sign * SpRand.constant_pos(rng)
 
     @staticmethod
-    def symbols(n: int) -> List[sp.Symbol]:
-        SYMBOLS = "a b r s t u v w x y z".split()
+    def symbols(n: int, rng: Optional[random.Random] = None) -> List[sp.Symbol]:
         if n > len(SYMBOLS):
             raise ValueError("Not enough symbols to generate.")
-        while True:
-            selected = random.choices(SYMBOLS, k=n)
-            if len(set(selected)) == n:
-                break
-        return list(map(sp.Symbol, selected))
-
-    @staticmethod
-    def function_with_difficulty():
-        def pow(power, evaluate=False):
-            return sp.Pow(sp.symbols("a"), power)
-
-        def linear(symbol, evaluate=False):
-            return SpRand.constant() * symbol
-
-        # (function, difficulty)
-        FUNCS = [
-            (linear, 1),
-            (sp.exp, 2),
-            (sp.log, 2),
-            (sp.sin, 3),
-            (sp.cos, 3),
-            (sp.tan, 3),
-            (sp.cot, 4),
-            (sp.sec, 4),
-            (sp.csc, 4),
-            (sp.atan, 5),
-            (sp.asin, 5),
-            (sp.acos, 5),
-            (pow, 5),
-        ]
-        WEIGHTS = [1 / 13] * 13
-        return random.choices(FUNCS, weights=WEIGHTS, k=1)[0]
+        return (rng or SpRand.rng).sample(list(SYMBOLS.values()), n)
+
+    @staticmethod
+    def function_with_difficulty(rng: Optional[random.Random] = None):
+        return (rng or SpRand.rng).choice(FUNCTIONS)
+
+    @staticmethod
+    def bind(func, rng: Optional[random.Random] = None):
+        # draws the random parameters of a FUNCTIONS entry once, up front
+        if func is _linear:
+            return partial(_linear, constant=SpRand.constant(rng))
+        return func
+
+    @staticmethod
+    def draw_many(
+        n: int, n_symbols: int = 3, rng: Optional[np.random.Generator] = None
+    ) -> Tuple[List[sp.Expr], np.ndarray, List[Tuple[sp.Symbol, ...]]]:
+        # batches of (signed constant, its difficulty) and distinct symbol tuples
+        if n_symbols > len(SYMBOLS):
+            raise ValueError("Not enough symbols to generate.")
+        rng = rng or SpRand.np_rng
+        table = np.array(primes(1, 100))
+        kinds = rng.choice(
+            len(SpRand.CONSTANT_KINDS), size=n, p=SpRand.CONSTANT_WEIGHTS
+        )
+        signs = rng.choice([-1, 1], size=n)
+        numerators = table[rng.integers(0, len(table), size=n)]
+        denominators = table[rng.integers(0, len(table), size=n)]
+
+        constants = []
+        for kind, sign, p, q in zip(kinds, signs, numerators, denominators):
+            name = SpRand.CONSTANT_KINDS[kind]
+            if name == "integer":
+                value = sp.Integer(int(p))
+            elif name == "rational":
+                value = sp.Rational(int(p), int(q))
+            else:
+                value = sp.pi if name == "pi" else sp.E
+            constants.append(int(sign) * value)
+        difficulties = np.array(SpRand.CONSTANT_DIFFICULTIES)[kinds] + (signs < 0)
+
+        names = list(SYMBOLS.values())
+        order = np.argsort(rng.random((n, len(names))), axis=1)[:, :n_symbols]
+        symbols = [tuple(names[i] for i in row) for row in order]
+        return constants, difficulties, symbols
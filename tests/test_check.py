@@ -0,0 +1,50 @@
+import time
+
+import pytest
+import sympy as sp
+
+from src.check import check_answer, check_token_answers
+from src.differential import is_generatable, problem_classes
+from src.executor import render_cas
+from src.utils import SpRand
+
+x = sp.Symbol("x")
+TOPICS = [id for id in problem_classes if is_generatable(id)]
+
+
+@pytest.mark.parametrize("topic_id", TOPICS)
+def test_accepts_the_rendered_answers(topic_id):
+    SpRand.seed(topic_id)
+    for record in render_cas(topic_id, 10):
+        answers = [record.answer] + ([record.numeric] if record.numeric else [])
+        results = check_token_answers(record.answer_source, answers, 2)
+        assert all(results), (record.expression, answers)
+
+
+@pytest.mark.parametrize(
+    "expected, answer",
+    [
+        (sp.log(x), r"\log{\left(x \right)}"),
+        (sp.log(x) ** 2, r"\log{\left(x \right)}^{2}"),
+        (1 / (x * sp.log(x)), r"\frac{1}{x \log{\left(x \right)}}"),
+        (sp.asin(x) ** 2, r"\operatorname{asin}^{2}{\left(x \right)}"),
+        (sp.log(x, 10), r"\log_{10}(x)"),
+    ],
+)
+def test_reads_sympy_latex(expected, answer):
+    assert check_answer(expected, answer)
+
+
+def test_rejects_wrong_answers():
+    answers = [r"\log_{10}(x)", "x", "1, 2"]
+    assert check_token_answers(sp.srepr(sp.log(x)), answers) == [False] * 3
+
+
+def test_budget_bounds_expensive_answers():
+    started = time.monotonic()
+    assert check_token_answers(sp.srepr(x), ["9^{9^{8}}", "x"], 1) == [False, True]
+    assert time.monotonic() - started < 5
+    with pytest.raises(TimeoutError):
+        check_token_answers(
+            sp.srepr(x), [f"9^{{9^{{{i}}}}}" for i in range(8, 14)], 1, 2
+        )
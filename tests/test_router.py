@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+
+from bench.common import free_port, serve
+from src import llm
+from src.llm import Client
+from src.router import Router
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture(scope="module")
+def fast_url():
+    with serve("src.stub_llm:app", {"STUB_LLM_LATENCY": "0.01"}) as (url, _):
+        yield f"{url}/v1"
+
+
+@pytest.fixture(scope="module")
+def slow_url():
+    with serve("src.stub_llm:app", {"STUB_LLM_LATENCY": "2"}) as (url, _):
+        yield f"{url}/v1"
+
+
+@pytest.fixture(autouse=True)
+def http_client(monkeypatch):
+    # the shared connection pool belongs to one event loop, every test runs its own
+    monkeypatch.setattr(llm, "_http_client", None)
+
+
+def client(model: str, url: str) -> Client:
+    return Client("ollama", model, api_url=url, timeout=5, backoff_base=0)
+
+
+def test_fails_over_and_avoids_a_dead_backend(fast_url):
+    dead = client("dead", f"http://127.0.0.1:{free_port()}/v1")
+    router = Router([dead, client("stub", fast_url)])
+
+    async def run():
+        return [await router.chat(MESSAGES, max_retries=1) for _ in range(4)]
+
+    assert all(asyncio.run(run()))
+    dead_backend, stub_backend = router.backends
+    # tried once, then scored as slow as its timeout
+    assert dead_backend.error_rate == pytest.approx(0.2)
+    assert dead_backend.score(router.error_penalty) > 0
+    assert router.pick() is stub_backend
+
+
+def test_raises_when_every_backend_fails():
+    router = Router([client("dead", f"http://127.0.0.1:{free_port()}/v1")])
+    with pytest.raises(Exception):
+        asyncio.run(router.chat(MESSAGES, max_retries=1))
+
+
+def test_hedge_returns_the_faster_backend(fast_url, slow_url):
+    router = Router(
+        [client("slow", slow_url), client("fast", fast_url)], hedge_delay=0.2
+    )
+
+    async def run():
+        started = time.monotonic()
+        content = await router.chat(MESSAGES)
+        return content, time.monotonic() - started
+
+    content, elapsed = asyncio.run(run())
+    assert content
+    assert elapsed < 1.5
+    slow_backend, fast_backend = router.backends
+    assert slow_backend.inflight == 0 and fast_backend.inflight == 0
+    assert fast_backend.latency is not None